@@ -0,0 +1,129 @@
+import collections
+import threading
+import time
+
+# poll priorities, polls below normal priority are deferred when the
+# budget of a cycle is used up
+PRIO_LOW = 0
+PRIO_NORMAL = 1
+PRIO_HIGH = 2
+
+PRIORITIES = {
+    'low': PRIO_LOW,
+    'normal': PRIO_NORMAL,
+    'high': PRIO_HIGH,
+}
+
+def char_time(rate):
+    '''Time on the wire of one RTU character
+
+    A character is 11 bits: start, 8 data, parity (or a second stop
+    bit) and stop.
+    '''
+    return 11.0 / rate
+
+def frame_gap(rate):
+    '''Silent interval between RTU frames
+
+    3.5 character times, fixed at 1.75 ms above 19200 baud as per the
+    Modbus serial line specification.
+    '''
+    if rate > 19200:
+        return 0.00175
+    return 3.5 * char_time(rate)
+
+class Airtime:
+    """
+    Accounts the time each unit occupies one serial port.
+
+    Every transaction is charged the wire time of its request and
+    response at the port's rate plus one inter-frame gap after each,
+    a transaction that is not answered is charged the time spent
+    waiting for the answer, since nothing else can use the line
+    meanwhile.  Utilisation is reported over a sliding window and
+    low priority polls are refused once the budget of the current
+    cycle is used up.
+    """
+    window = 60
+    cycle = 1.0
+    budget = 0.8
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.history = collections.deque()
+        self.total = 0
+        self.units = collections.Counter()
+        self.cycle_start = 0
+        self.cycle_used = 0
+        self.deferred = 0
+
+    def frame_time(self, nbytes):
+        if not self.rate:
+            return 0
+        return nbytes * char_time(self.rate) + frame_gap(self.rate)
+
+    def transaction_time(self, nbytes):
+        '''Wire time of a request and its response, nbytes in total'''
+        if not self.rate:
+            return 0
+        return self.frame_time(nbytes) + frame_gap(self.rate)
+
+    def roll_cycle(self, now):
+        if now - self.cycle_start >= self.cycle:
+            self.cycle_start = now - (now - self.cycle_start) % self.cycle
+            self.cycle_used = 0
+
+    def expire(self, now):
+        while self.history and now - self.history[0][0] > self.window:
+            t, unit, used = self.history.popleft()
+            self.total -= used
+            self.units[unit] -= used
+
+    def record(self, unit, used):
+        '''Charge `used` seconds of bus time to a unit'''
+        now = time.time()
+        with self.lock:
+            self.roll_cycle(now)
+            self.cycle_used += used
+            self.expire(now)
+            self.history.append((now, unit, used))
+            self.total += used
+            self.units[unit] += used
+
+    def transaction(self, unit, nbytes, elapsed, answered):
+        '''Charge a transaction of nbytes request and response bytes'''
+        if answered:
+            used = self.transaction_time(nbytes)
+        else:
+            used = elapsed + frame_gap(self.rate) if self.rate else 0
+        self.record(unit, used)
+
+    def admit(self, nbytes, priority):
+        '''
+        Check whether a poll fits in the budget of the current cycle,
+        only polls below normal priority are ever refused.
+        '''
+        if priority >= PRIO_NORMAL:
+            return True
+
+        now = time.time()
+        with self.lock:
+            self.roll_cycle(now)
+            if self.cycle_used + self.transaction_time(nbytes) <= \
+               self.budget * self.cycle:
+                return True
+            self.deferred += 1
+            return False
+
+    def next_cycle(self):
+        with self.lock:
+            return self.cycle_start + self.cycle
+
+    def utilisation(self, unit=None):
+        '''Percentage of the window the port, or one unit, used the bus'''
+        now = time.time()
+        with self.lock:
+            self.expire(now)
+            used = self.total if unit is None else self.units[unit]
+        return 100.0 * max(used, 0) / self.window
@@ -3,16 +3,17 @@ import probe
 from register import *
 
 class Reg_ver(Reg, int):
+    # The version is kept as the int 0xMMmmbb, major, minor and build,
+    # which compares like the version itself
     def __init__(self, base, name):
-        super().__init__(base, 1, name, text='%d.%d.%d')
+        super().__init__(base, 1, name)
 
-    def __int__(self):
-        v = self.value
-        return v[0] << 16 | v[1] << 8 | v[2]
+    def format(self, value):
+        return '%d.%d.%d' % (value >> 16, value >> 8 & 0xff, value & 0xff)
 
     def decode(self, values):
         v = values[0]
-        return self.update((v >> 12, v >> 8 & 0xf, v & 0xff))
+        return self.update((v >> 12) << 16 | (v >> 8 & 0xf) << 8 | v & 0xff)
 
 nr_phases = [ 3, 3, 2, 1, 3 ]
 
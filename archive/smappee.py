@@ -58,18 +58,16 @@ class Reg_ser(Reg, str):
         return self.update(v)
 
 class Reg_ver(Reg, int):
+    # The version is kept as the int major << 16 | minor, which compares
+    # like the version itself
     def __init__(self, base, *args):
         super().__init__(base, 2, *args)
 
-    def __int__(self):
-        v = self.value
-        return v[0] << 16 | v[1]
-
-    def __str__(self):
-        return '%d.%d' % self.value
+    def format(self, value):
+        return '%d.%d' % (value >> 16, value & 0xffff)
 
     def decode(self, values):
-        return self.update((values[1], values[0]))
+        return self.update(values[1] << 16 | values[0])
 
 class CurrentTransformer:
     def __init__(self, dev, slot, sdev, chan):
@@ -113,7 +111,7 @@ class PowerBox(device.CustomName, device.EnergyMeter):
     vendor_name = 'Smappee'
     productid = 0xb018
     productname = 'Smappee Power Box'
-    min_fwver = (1, 44)
+    min_fwver = 1 << 16 | 44
     age_limit_fast = 0
     refresh_time = 100
 
@@ -207,7 +205,8 @@ class PowerBox(device.CustomName, device.EnergyMeter):
 
         fw = self.read_register(self.info_regs[1])
         if fw < self.min_fwver:
-            self.log.info('%s firmware %s is too old', self.productname, fw)
+            self.log.info('%s firmware %s is too old', self.productname,
+                          self.info_regs[1].format(fw))
             raise Exception()
 
         # reset CT slot mapping
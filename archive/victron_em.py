@@ -42,7 +42,7 @@ class VE_Meter_A1B1(vreglink.VregLink, device.EnergyMeter):
             Reg_s32b(power,    '/Ac/L%d/Power' % n,            1, '%.1f W'),
         ]
 
-        if self.fwver < (0, 1, 7, 0):
+        if self.fwver < 0x010700:
             return
 
         self.data_regs += [
@@ -74,7 +74,7 @@ class VE_Meter_A1B1(vreglink.VregLink, device.EnergyMeter):
             self.role = self.role_names[role_id]
 
         self.fwver = self.read_register(self.info_regs[1])
-        if self.fwver < (0, 1, 3, 1):
+        if self.fwver < 0x010301:
             self.log.info('Old firmware, data not available')
             return
 
@@ -92,7 +92,7 @@ class VE_Meter_A1B1(vreglink.VregLink, device.EnergyMeter):
         for n in phases:
             self.add_phase_regs(n)
 
-        if self.fwver < (0, 1, 5, 255):
+        if self.fwver < 0x0105ff:
             return
 
         if self.role == 'pvinverter':
@@ -100,7 +100,7 @@ class VE_Meter_A1B1(vreglink.VregLink, device.EnergyMeter):
             self.position = self.read_register(posreg)
             self.data_regs.append(posreg)
 
-        if self.fwver < (0, 1, 7, 0):
+        if self.fwver < 0x010700:
             return
 
         self.data_regs += [
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Compares the pymodbus and the native RTU client on a pty loopback.
+
+A thread on the master side of a pseudo terminal answers register
+reads like a unit would.  With a baud rate given it holds back each
+response for the time request and response take on the wire, which
+is printed for comparison, otherwise it answers at once.  Both
+clients read the same registers in the same number of transactions
+and decode them with a RegDecoder.  The elapsed time includes the 3.5
+character gap between frames both clients keep, the processor time,
+of the client and the responder, is what they spend on a transaction.
+"""
+
+from argparse import ArgumentParser
+import os
+import struct
+import threading
+import time
+
+from pymodbus.client.sync import ModbusSerialClient
+
+from register import Reg_u16
+from rtu import RtuClient, crc16
+import device
+
+def wire_time(nbytes, baudrate):
+    return 11 * nbytes / baudrate if baudrate else 0
+
+def responder(fd, baudrate):
+    while True:
+        try:
+            req = os.read(fd, 8)
+        except OSError:
+            return
+        if len(req) < 8:
+            continue
+
+        unit, func, base, count = struct.unpack('>BBHH', req[:6])
+        data = struct.pack('>%dH' % count,
+                           *((base + i) & 0xffff for i in range(count)))
+        resp = struct.pack('>BBB', unit, func, len(data)) + data
+        time.sleep(wire_time(len(req) + len(resp) + 2, baudrate))
+        os.write(fd, resp + struct.pack('<H', crc16(resp)))
+
+def bench(name, modbus, regs, rounds):
+    start = regs[0].base
+    count = regs.span()
+    decoder = regs.decoder(start, count)
+    now = time.time()
+
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    for i in range(rounds):
+        rr = modbus.read_input_registers(start, count, unit=1)
+        if rr.isError():
+            raise Exception(rr)
+        decoder.decode(decoder.data(rr), now)
+    t = time.perf_counter() - t0
+    c = time.process_time() - c0
+
+    print('%-8s %6.3f ms per transaction of %d registers, %6.3f ms cpu' %
+          (name, 1000 * t / rounds, count, 1000 * c / rounds))
+
+def main():
+    parser = ArgumentParser(add_help=True)
+    parser.add_argument('-n', '--registers', type=int, default=40)
+    parser.add_argument('-r', '--rounds', type=int, default=2000)
+    parser.add_argument('-b', '--baudrate', type=int, default=0,
+                        help='simulated line speed, 0 for none')
+    args = parser.parse_args()
+    baudrate = args.baudrate or 115200
+
+    master, slave = os.openpty()
+    tty = os.ttyname(slave)
+    threading.Thread(target=responder, args=(master, args.baudrate),
+                     daemon=True).start()
+
+    regs = device.RegList('input', [Reg_u16(i, '/R%d' % i)
+                                    for i in range(args.registers)])
+
+    if args.baudrate:
+        print('wire     %6.3f ms per transaction' %
+              (1000 * wire_time(8 + 5 + 2 * args.registers, args.baudrate)))
+
+    pm = ModbusSerialClient(method='rtu', port=tty, baudrate=baudrate,
+                            timeout=1)
+    pm.connect()
+    bench('pymodbus', pm, regs, args.rounds)
+    pm.close()
+
+    rtu = RtuClient(tty, baudrate)
+    rtu.connect()
+    bench('native', rtu, regs, args.rounds)
+    rtu.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Compares the vedbus export paths on a synthetic service.
+
+A service with 1000 paths, a third each floats with a text format, ints
+and strings, is updated completely in every round and flushed as one
+ItemsChanged, then the whole tree is read back with GetItems as the GUI
+does on connect.  Run it on the target, it needs a D-Bus to register on.
+
+"original" renders every change when it is set and builds GetItems by
+wrapping each value, as vedbus did before ServiceContext deferred the
+rendering to the flush.  "plain" is the current ServiceContext with
+VeDbusItemExport, "typed" the same with VeDbusTypedItemExport.
+"""
+
+from argparse import ArgumentParser
+import random
+import time
+
+import dbus.mainloop.glib
+
+from utils import private_bus
+from ve_utils import wrap_dbus_value
+from vedbus import VeDbusService, ServiceContext
+from vedbus import VeDbusItemExport, VeDbusTypedItemExport
+
+class OriginalContext(ServiceContext):
+    """ServiceContext rendering each change as it is set"""
+
+    def __setitem__(self, path, newvalue):
+        c = self.parent._dbusobjects[path]._local_set_value(newvalue)
+        if c is not None:
+            self.changes[path] = c
+
+    def flush(self):
+        if self.changes:
+            self.parent._dbusnodes['/'].ItemsChanged(self.changes)
+            self.changes.clear()
+
+    def add_path(self, path, value, *args, **kwargs):
+        self.parent.add_path(path, value, *args, **kwargs)
+        self.changes[path] = {
+            'Value': wrap_dbus_value(value),
+            'Text': self.parent._dbusobjects[path].GetText()
+        }
+
+def original_items(svc):
+    return {
+        path: {
+            'Value': wrap_dbus_value(item.local_get_value()),
+            'Text': item.GetText() }
+        for path, item in svc._dbusobjects.items()
+    }
+
+def root_items(svc):
+    return svc._dbusnodes['/'].GetItems()
+
+def text(path, value):
+    return '%.1f W' % value
+
+def make_service(name, itemtype, context, npaths):
+    svc = VeDbusService(name, private_bus(), itemtype=itemtype)
+    ctx = context(svc)
+
+    for i in range(npaths):
+        if i % 3 == 0:
+            ctx.add_path('/Float/%d' % i, 0.0, gettextcallback=text)
+        elif i % 3 == 1:
+            ctx.add_path('/Int/%d' % i, 0)
+        else:
+            ctx.add_path('/Str/%d' % i, '')
+
+    ctx.flush()
+    return svc, ctx
+
+def update(ctx, paths, n):
+    for p in paths:
+        if p.startswith('/Float'):
+            ctx[p] = random.random() * 1000
+        elif p.startswith('/Int'):
+            ctx[p] = n
+        else:
+            ctx[p] = 'state %d' % n
+
+def bench(name, itemtype, context, get_items, npaths, rounds, reads):
+    svc, ctx = make_service('com.victronenergy.bench.' + name,
+                            itemtype, context, npaths)
+    paths = list(svc._dbusobjects)
+
+    t_update = t_flush = t_items = 0
+
+    for n in range(rounds):
+        t0 = time.perf_counter()
+        update(ctx, paths, n)
+        t1 = time.perf_counter()
+        ctx.flush()
+        t2 = time.perf_counter()
+        for i in range(reads):
+            get_items(svc)
+        t3 = time.perf_counter()
+
+        t_update += t1 - t0
+        t_flush += t2 - t1
+        t_items += t3 - t2
+
+    svc.__del__()
+
+    print('%-8s update %7.2f ms  flush %7.2f ms  GetItems %7.2f ms' %
+          (name, 1000 * t_update / rounds, 1000 * t_flush / rounds,
+           1000 * t_items / max(rounds * reads, 1)))
+
+def main():
+    parser = ArgumentParser(add_help=True)
+    parser.add_argument('-n', '--paths', type=int, default=1000)
+    parser.add_argument('-r', '--rounds', type=int, default=20)
+    parser.add_argument('-g', '--getitems', type=int, default=2,
+                        help='GetItems calls per round')
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    bench('original', VeDbusItemExport, OriginalContext, original_items,
+          args.paths, args.rounds, args.getitems)
+    bench('plain', VeDbusItemExport, ServiceContext, root_items,
+          args.paths, args.rounds, args.getitems)
+    bench('typed', VeDbusTypedItemExport, ServiceContext, root_items,
+          args.paths, args.rounds, args.getitems)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import threading
+import time
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+STATE_NAMES = {
+    CLOSED: 'Closed',
+    OPEN: 'Open',
+    HALF_OPEN: 'Half-open',
+}
+
+class CircuitBreaker:
+    """
+    Tracks whether a unit answers and stops polling it when it does not.
+
+    The breaker trips open after `threshold` consecutive failed
+    transactions.  While open, polls are parked instead of occupying
+    the bus and the unit is only probed when `next_probe` is reached,
+    with the delay doubling after every failed probe up to
+    `backoff_max`.  A probe in progress puts the breaker half-open, a
+    good answer closes it and resumes the parked polls.
+    """
+    threshold = 3
+    backoff_min = 5
+    backoff_max = 300
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive = 0
+        self.failures = 0
+        self.trips = 0
+        self.probes = 0
+        self.backoff = self.backoff_min
+        self.next_probe = 0
+        self.parked = []
+
+    def closed(self):
+        return self.state == CLOSED
+
+    def success(self):
+        with self.lock:
+            self.consecutive = 0
+            if self.state == CLOSED:
+                return
+            self.state = CLOSED
+            self.backoff = self.backoff_min
+            resume = self.parked
+            self.parked = []
+
+        for r in resume:
+            r()
+
+    def failure(self):
+        '''
+        Record a failed transaction, returns True if the breaker
+        opened and a probe needs to be scheduled.
+        '''
+        with self.lock:
+            self.consecutive += 1
+            self.failures += 1
+
+            if self.state == HALF_OPEN:
+                self.backoff = min(2 * self.backoff, self.backoff_max)
+            elif self.state == OPEN or self.consecutive < self.threshold:
+                return False
+            else:
+                self.trips += 1
+                self.backoff = self.backoff_min
+
+            self.state = OPEN
+            self.next_probe = time.time() + self.backoff
+            return True
+
+    def probe(self):
+        with self.lock:
+            self.state = HALF_OPEN
+            self.probes += 1
+
+    def park(self, resume):
+        '''Hold a poll until the breaker closes, returns False if closed'''
+        with self.lock:
+            if self.state == CLOSED:
+                return False
+            self.parked.append(resume)
+            return True
+
+    def state_text(self, path=None, val=None):
+        return STATE_NAMES[self.state if val is None else val]
@@ -0,0 +1,100 @@
+import collections
+import dbus.lowlevel
+import logging
+import os
+
+from utils import private_bus
+
+# Venus OS has _tracemalloc, but no tracemalloc
+try:
+    import _tracemalloc
+except ImportError:
+    _tracemalloc = None
+
+log = logging.getLogger(__name__)
+
+def traced_memory():
+    '''Bytes allocated by Python, 0 unless tracemalloc is tracing'''
+    if _tracemalloc is None or not _tracemalloc.is_tracing():
+        return 0
+    return _tracemalloc.get_traced_memory()[0]
+
+def open_fds():
+    '''Number of open file descriptors, 0 if unknown'''
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return 0
+
+class BusConnection:
+    """A connection handed out by the pool and what it costs"""
+
+    def __init__(self, name, conn, mem, fds):
+        self.name = name
+        self.conn = conn
+        self.mem = mem
+        self.fds = fds
+        self.received = 0
+        conn.add_message_filter(self.filter)
+
+    def filter(self, conn, msg):
+        self.received += 1
+        return dbus.lowlevel.HANDLER_RESULT_NOT_YET_HANDLED
+
+class BusPool:
+    """
+    Hands out the D-Bus connections of the process.
+
+    Settings, imported items and signal subscriptions all go over one
+    shared connection.  It does not bring down the number of
+    connections of exported services: object paths are registered per
+    connection and every service exports the same paths, so each one
+    still has its own, which is closed when the service is released
+    instead of lingering until garbage collection.
+
+    The messages received on each connection are counted, as are the
+    file descriptors its setup opened and, while tracemalloc traces,
+    the Python memory it allocated.  The buffers of libdbus are not
+    seen by either.
+    """
+
+    def __init__(self):
+        self.shared_bus = None
+        self.conns = collections.OrderedDict()
+
+    def open(self, name):
+        mem = traced_memory()
+        fds = open_fds()
+        conn = private_bus()
+        c = BusConnection(name, conn, traced_memory() - mem,
+                          open_fds() - fds)
+        self.conns[conn] = c
+        return conn
+
+    def shared(self):
+        if self.shared_bus is None:
+            self.shared_bus = self.open('shared')
+        return self.shared_bus
+
+    def service(self, name):
+        return self.open(name)
+
+    def release(self, conn):
+        if conn is self.shared_bus:
+            return
+        c = self.conns.pop(conn, None)
+        if c is None:
+            return
+        conn.close()
+        log.debug('closed connection of %s, %d messages received',
+                  c.name, c.received)
+
+    def stats(self):
+        return {
+            'connections': len(self.conns),
+            'fds': sum(c.fds for c in self.conns.values()),
+            'received': sum(c.received for c in self.conns.values()),
+            'mem': sum(c.mem for c in self.conns.values()) // 1024,
+        }
+
+buspool = BusPool()
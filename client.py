@@ -8,6 +8,10 @@ from pymodbus.utilities import computeCRC
 import serial
 import resource
 
+from devspec import NetDevSpec, SerialDevSpec
+from mbap import MbapClient
+from rtu import RtuClient
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -47,23 +51,9 @@ class ModbusExtras:
 
         raise Exception('Invalid register access type: %s' % access)
 
-class TcpClient(ModbusExtras, ModbusTcpClient):
-    method = 'tcp'
-
-class UdpClient(ModbusExtras, ModbusUdpClient):
-    method = 'udp'
-
-    @property
-    def timeout(self):
-        return self._timeout
-
-    @timeout.setter
-    def timeout(self, t):
-        self._timeout = t
-        if self.socket:
-            self.socket.settimeout(t)
-
 class SerialClient(ModbusExtras, ModbusSerialClient):
+    native = False
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.lock = threading.RLock()
@@ -77,12 +67,6 @@ class SerialClient(ModbusExtras, ModbusSerialClient):
         if self.socket:
             return True
         try:
-            #self.socket = BusyPollSerial(port=self.port,
-            #                            timeout=self.timeout,
-            #                            bytesize=self.bytesize,
-            #                            stopbits=self.stopbits,
-            #                            baudrate=self.baudrate,
-            #                            parity=self.parity)
             self.socket = serial.Serial(port=self.port,
                                         timeout=self.timeout,
                                         bytesize=self.bytesize,
@@ -133,74 +117,64 @@ class SerialClient(ModbusExtras, ModbusSerialClient):
         print(f'<<<')
 
 
-class BusyPollSerial(serial.Serial):
-    """\
-    Poll based read implementation. Not all systems support poll properly.
-    However this one has better handling of errors, such as a device
-    disconnecting while it's in use (e.g. USB-serial unplugged).
-    """
-
-
-    def read(self, size=1):
-        """\
-        Read size bytes from the serial port. If a timeout is set it may
-        return less characters as requested. With no timeout it will block
-        until the requested number of bytes is read.
-
-        Reading is done using repated read since select with a timeout causes 
-        a memory leak.
-        """
-        if not self.is_open:
-            raise serial.PortNotOpenError()
-        read = bytearray()
-        start_read = time.time()
-        interbyteTimeout = 0
-        readTimeout = 0
-        nreads = 0
-        if size > 0:
-            while len(read) < size:
-                if self.breakout and False:
-                    break
-                else:
-                    nreads = nreads + 1
-                    buf = os.read(self.fd, size - len(read))
-                    end_read = time.time()
-                    # test for timeouts.
-                    #if self._inter_byte_timeout is not None:
-                    #    if end_read - start_this_read > self._inter_byte_timeout*5.0:
-                    #        interbyteTimeout = end_read - start_this_read
-                    #        break # timeout
-                    if self._timeout is not None:
-                        if end_read - start_read > self._timeout:
-                            readTimeout = end_read - start_read
-                            break # timeout
-                    if len(buf) == 0:
-                        time.sleep(0.1)
-                    else:
-                        read.extend(buf)
-        if len(read) < size:
-            if not self.breakout:
-                print(f'not enough bytes unit:{self.unit_id} interbyte:{interbyteTimeout} readTimeout::{readTimeout} {len(read)} {size} ')
-        return bytes(read)
-
+serial_ports = {}
+net_clients = {}
 
+def make_net_client(spec):
+    """
+    Returns the client of a Modbus TCP or UDP host and port, shared by
+    all units behind it.  The client connects on demand, a host that
+    is not reachable yet is retried with backoff by its transactions.
+    Clients stay in the pool while unused to keep their backoff.
+    """
+    key = (spec.method, spec.target, spec.port)
+    client = net_clients.get(key)
 
+    if client is None:
+        log.info('Creating %s client for %s:%d',
+                 spec.method, spec.target, spec.port)
+        client = net_clients[key] = MbapClient(*key)
+        client.refcount = 0
 
+    return client.get()
 
-serial_ports = {}
+def client_framer(method, framer):
+    '''The framer make_client() actually uses for a serial method'''
+    if framer == 'native' and method != 'rtu':
+        return 'pymodbus'
+    return framer
 
+def make_client(tty, rate=None, method=None, framer='pymodbus'):
+    """
+    Returns the client of a serial port, shared by all its devices.
+    The framer selects pymodbus or the native RTU client, which only
+    speaks RTU.  A device spec can be given instead of the port, rate
+    and method, network specs get a pooled network client.
+    """
+    if isinstance(tty, NetDevSpec):
+        return make_net_client(tty)
 
+    if isinstance(tty, SerialDevSpec):
+        tty, rate, method = tty.target, tty.rate, tty.method
 
-def make_client(tty, rate, method):
+    if client_framer(method, framer) != framer:
+        log.warning('Native framer needs RTU, using pymodbus on %s', tty)
+        framer = 'pymodbus'
 
     if tty in serial_ports:
         client = serial_ports[tty]
-        if client.baudrate != rate:
-            raise Exception('rate mismatch on %s' % tty)
-        return client.get()
-
-    log.info(f'Creating serial client on {tty} rate {rate}')
-    client = SerialClient(method, port=tty, baudrate=rate)
+        if client.baudrate == rate and client.native == (framer == 'native'):
+            return client.get()
+        if client.refcount > 0:
+            raise Exception('rate or framer mismatch on %s' % tty)
+        # no longer used, reopen at the new rate
+        del serial_ports[tty]
+
+    log.info(f'Creating {framer} serial client on {tty} rate {rate}')
+    if framer == 'native':
+        client = RtuClient(tty, rate)
+    else:
+        client = SerialClient(method, port=tty, baudrate=rate)
     if not client.connect():
         client.put()
         return None
@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+
+from devspec import NetDevSpec, SerialDevSpec
+
+log = logging.getLogger(__name__)
+
+CONFIG_FILE = '/data/conf/dbus-modbus-client.json'
+
+# used when there is no configuration file
+DEFAULT_CONFIG = {
+    'devices': [
+        { 'model': 'SDM230Modbusv2', 'unit': 2 },
+        { 'model': 'Growatt MIN 4200-TL', 'unit': 1 },
+    ],
+}
+
+class DeviceConfig:
+    """
+    The devices of one port as configured.
+
+    The configuration is JSON:
+
+        {
+          "ports": { "/dev/ttyUSB0": { "rate": 9600, "framer": "native" } },
+          "devices": [
+            { "model": "SDM230Modbusv2", "port": "/dev/ttyUSB0", "unit": 2,
+              "overrides": {
+                "/Ac/Frequency": { "max_age": 30, "priority": "low",
+                                   "deadband": 0.01 } } },
+            { "model": "SDM230Modbusv2", "port": "/dev/ttyUSB0", "unit": 3,
+              "host": "192.168.1.20:502", "method": "tcp" }
+          ]
+        }
+
+    Devices without a port belong to every port, a port without a rate
+    or framer uses the one given on the command line.  The framer is
+    pymodbus or native, the RTU client of this package.  Overrides are keyed by
+    path and may set max_age, priority (low, normal, high) and deadband,
+    a number or the arguments of a Deadband.
+
+    A device with a host is reached over Modbus TCP, or UDP, through
+    that host, port 502 unless given.  It is polled by the process of
+    the serial port in its port only, a network device without a port
+    is ignored since every process would create it.
+    """
+
+    def __init__(self, path, tty, rate, mode, framer='pymodbus'):
+        self.path = path
+        self.tty = tty
+        self.default_rate = rate
+        self.default_framer = framer
+        self.mode = mode
+        self.mtime = None
+        self.loaded = False
+        self.rate = rate
+        self.framer = framer
+        self.devices = {}
+
+    def changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except (OSError, TypeError):
+            mtime = None
+
+        if mtime == self.mtime and self.loaded:
+            return False
+
+        self.mtime = mtime
+        return True
+
+    @staticmethod
+    def net_spec(d):
+        host, _, port = d['host'].partition(':')
+        method = d.get('method', 'tcp')
+        if method not in ('tcp', 'udp'):
+            raise ValueError('unknown method %s' % method)
+        return NetDevSpec(method, host, int(port or 502), int(d['unit']))
+
+    def read(self):
+        if self.mtime is None:
+            return DEFAULT_CONFIG
+
+        with open(self.path) as f:
+            return json.load(f)
+
+    def load(self):
+        """
+        Reads the configuration, returns False if it is unusable and
+        the previous one was kept.
+        """
+        self.loaded = True
+
+        try:
+            conf = self.read()
+            port = conf.get('ports', {}).get(self.tty, {})
+            rate = port.get('rate', self.default_rate)
+            framer = port.get('framer', self.default_framer)
+            if framer not in ('pymodbus', 'native'):
+                raise ValueError('unknown framer %s' % framer)
+            devices = {}
+
+            for d in conf.get('devices', []):
+                if 'host' in d:
+                    if d.get('port') != self.tty:
+                        continue
+                    spec = self.net_spec(d)
+                elif d.get('port', self.tty) != self.tty:
+                    continue
+                else:
+                    spec = SerialDevSpec(self.mode, self.tty, rate,
+                                         int(d['unit']))
+                devices[spec] = (d['model'], d.get('overrides', {}))
+        except Exception as ex:
+            log.error('Invalid configuration %s: %s', self.path, ex)
+            return False
+
+        self.rate = rate
+        self.framer = framer
+        self.devices = devices
+        return True
@@ -23,12 +23,16 @@ import watchdog
 
 
 import client
-from devspec import SerialDevSpec
+from poller import release_pollers
+from publisher import publisher
+from buspool import buspool
+from identcache import identity_cache, CACHE_FILE
+from config import DeviceConfig, CONFIG_FILE
+from devspec import NetDevSpec
 
 
-# Only enable the devices known to be present
-import eastron_sdm230
-import growatt_pv_v120
+# drivers are imported when a device needs them
+import drivers
 
 
 import logging
@@ -39,18 +43,22 @@ VERSION = '2.01'
 
 __all__ = ['NAME', 'VERSION']
 
-# this is in milliseconds
-UPDATE_INTERVAL = 100
+# this is in milliseconds, only used for housekeeping since the data
+# registers are read by each port's poller when they are due
+UPDATE_INTERVAL = 1000
 
 
 def percent(path, val):
     return '%d%%' % val
 
 class Client:
-    def __init__(self, tty, rate, mode):
+    def __init__(self, tty, rate, mode, config_path=CONFIG_FILE,
+                 framer='pymodbus'):
         self.tty = tty
+        self.config_path = config_path
         self.rate = rate
         self.mode = mode
+        self.framer = framer
         self.devices = []
         self.failed = []
         self.failed_time = 0
@@ -83,30 +91,95 @@ class Client:
             'autoscan': [settings_path + '/AutoScan', 0, 0, 1],
         }
 
-        self.dbusconn = private_bus()
+        self.dbusconn = buspool.shared()
 
         log.info('Waiting for localsettings')
         self.settings = SettingsDevice(self.dbusconn, SETTINGS,
                                        self.setting_changed, timeout=10)
 
     def init_devices(self):
-
-        # hard code the devices based on the configuration.
-        # which for simplicity I am simpyl going to hard code here.
-        # This avoids scanning which fragments python memory
-
-        modbus = client.make_client(self.tty, self.rate, self.mode)
-
-        self.devices = [
-            eastron_sdm230.Eastron_SDM230v2(SerialDevSpec(self.mode,self.tty,self.rate,2), modbus, 'SDM230Modbusv2'),
-            growatt_pv_v120.GrowattPVInverter(SerialDevSpec(self.mode,self.tty,self.rate,1), modbus, 'Growatt MIN 4200-TL'),
-            # Add a fake unit to trigger the leak, hopefully
-            # growatt_pv_v120.GrowattPVInverter(SerialDevSpec(self.mode,self.tty,self.rate,5), modbus, 'Test5 Growatt MIN 4200-TL'),
-            #growatt_pv_v120.GrowattPVInverter(SerialDevSpec(self.mode,self.tty,self.rate,6), modbus, 'Test6 Growatt MIN 4200-TL'),
-            #growatt_pv_v120.GrowattPVInverter(SerialDevSpec(self.mode,self.tty,self.rate,7), modbus, 'Test7 Growatt MIN 4200-TL'),
-            #growatt_pv_v120.GrowattPVInverter(SerialDevSpec(self.mode,self.tty,self.rate,8), modbus, 'Test8 Growatt MIN 4200-TL'),
-        ]
-
+        self.modbus = None
+        self.config = DeviceConfig(self.config_path, self.tty, self.rate,
+                                   self.mode, self.framer)
+        self.update_devices()
+
+    def get_modbus(self, rate):
+        framer = client.client_framer(self.mode, self.config.framer)
+        if self.modbus and (self.modbus.baudrate != rate or
+                            self.modbus.native != (framer == 'native')):
+            self.modbus.put()
+            if self.modbus.refcount == 0:
+                release_pollers(self.modbus)
+            self.modbus = None
+
+        if not self.modbus:
+            self.modbus = client.make_client(self.tty, rate, self.mode,
+                                             framer)
+
+        return self.modbus
+
+    def update_devices(self):
+        """
+        Applies the device configuration when it changed: devices no
+        longer configured are removed, new ones created and those with
+        changed overrides reinitialised.
+        """
+        if not self.config.changed() or not self.config.load():
+            return
+
+        wanted = self.config.devices
+        devices = []
+
+        for d in self.devices:
+            conf = wanted.get(d.spec)
+            framer = client.client_framer(self.mode, self.config.framer)
+            native = framer == 'native'
+            if isinstance(d.spec, NetDevSpec):
+                native = d.modbus.native
+            if conf is None or conf[0] != d.model or d.modbus.native != native:
+                log.info('Removing %s', d)
+                d.destroy()
+                continue
+
+            if conf[1] != d.overrides:
+                log.info('New overrides for %s', d)
+                d.overrides = conf[1]
+                d.sched_reinit()
+
+            devices.append(d)
+
+        present = {d.spec for d in devices}
+
+        for spec, (model, overrides) in wanted.items():
+            if spec in present:
+                continue
+
+            try:
+                if isinstance(spec, NetDevSpec):
+                    modbus = client.make_client(spec)
+                else:
+                    modbus = self.get_modbus(spec.rate)
+            except Exception as ex:
+                # e.g. a rate the port is already in use at
+                log.error('Cannot open %s: %s', spec, ex)
+                continue
+            if not modbus:
+                continue
+
+            try:
+                d = drivers.create(model, spec, modbus)
+            except Exception as ex:
+                log.error('Cannot create %s on %s: %s', model, spec, ex)
+                continue
+            finally:
+                # the device holds its own reference to a network client
+                if isinstance(spec, NetDevSpec):
+                    modbus.put()
+
+            d.overrides = overrides
+            devices.append(d)
+
+        self.devices = devices
 
     def check_rss(self):
         rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -118,6 +191,8 @@ class Client:
                 elapsed = now - self.last_rss_change
                 rate = (3600.0*change)/(elapsed*1024)
             log.info(f' rss:{rss} change:{change} rate:{rate} MB/h')
+            bus = buspool.stats()
+            log.info(f' dbus connections:{bus["connections"]} fds:{bus["fds"]} received:{bus["received"]} mem:{bus["mem"]}kB')
             for d in self.devices:
                 d.print_metrics()
             self.rss = rss
@@ -129,6 +204,7 @@ class Client:
 
     def update_timer(self):
         try:
+            self.update_devices()
             for d in self.devices:
                 if d.init(self.dbusconn, True):
                     d.update()
@@ -154,16 +230,25 @@ class Client:
 
 def main():
     parser = ArgumentParser(add_help=True)
+    parser.add_argument('-c', '--config', default=CONFIG_FILE,
+                        help='Device configuration file')
     parser.add_argument('-d', '--debug', help='enable debug logging',
                         action='store_true')
     parser.add_argument('-f', '--force-scan', action='store_true')
     parser.add_argument('-F', '--force-devices')
     parser.add_argument('-m', '--mode', choices=['ascii', 'rtu'], default='rtu')
+    parser.add_argument('--framer', choices=['pymodbus', 'native'],
+                        default='pymodbus',
+                        help='Modbus RTU implementation of ports not configured')
     parser.add_argument('--models', action='store_true',
                         help='List supported device models')
     parser.add_argument('--leak',
                         help='Enable memory leak detection', default=120)
     parser.add_argument('-P', '--probe', action='append')
+    parser.add_argument('--publish-rate', type=float, default=4,
+                        help='Maximum rate of D-Bus change signals per second')
+    parser.add_argument('--identity-cache', default=CACHE_FILE,
+                        help='File caching device identities, empty to disable')
     parser.add_argument('-r', '--rate', type=int)
     parser.add_argument('-s', '--serial')
     parser.add_argument('-x', '--exit', action='store_true',
@@ -180,8 +265,15 @@ def main():
 
 
 
+    if args.models:
+        for m in sorted(drivers.get_models()):
+            print('%-20s %-20s %s' % m)
+        return
+
     log.info('%s v%s', NAME, VERSION)
 
+    drivers.register()
+
     signal.signal(signal.SIGINT, lambda s, f: os._exit(1))
     faulthandler.register(signal.SIGUSR1)
     faulthandler.enable()
@@ -190,7 +282,11 @@ def main():
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
     mainloop = GLib.MainLoop()
 
-    client = Client(args.serial, args.rate, args.mode)
+    publisher.rate = args.publish_rate
+    identity_cache.path = args.identity_cache
+
+    client = Client(args.serial, args.rate, args.mode, args.config,
+                    args.framer)
 
     client.err_exit = args.exit
     client.init(args.force_scan, force_devices=args.force_devices)
@@ -0,0 +1,73 @@
+class Deadband:
+    """
+    Limits publishing of a noisy value.
+
+    A change is held back while it is within `absolute` of the last
+    published value or within `relative`, a fraction, of it, and
+    changes are published at most every `interval` seconds.  A held
+    back value is published anyway once nothing was published for
+    `max_silence` seconds.  A value becoming valid or invalid is never
+    held back.
+    """
+
+    def __init__(self, absolute=0, relative=0, interval=0, max_silence=60):
+        self.absolute = absolute
+        self.relative = relative
+        self.interval = interval
+        self.max_silence = max_silence
+
+    def significant(self, old, new):
+        try:
+            d = abs(new - old)
+        except TypeError:
+            return new != old
+
+        return d > self.absolute and d > self.relative * abs(old)
+
+class Limiter:
+    """Publishing state of one path limited by a Deadband"""
+    __slots__ = ('deadband', 'value', 'time', 'pending')
+
+    def __init__(self, deadband):
+        self.deadband = deadband
+        self.value = None
+        self.time = 0
+        self.pending = None
+
+    def offer(self, value, now):
+        """
+        Record a new value, returns True if it is to be published now.
+        """
+        self.pending = value
+        return self.ready(now)
+
+    def ready(self, now):
+        if self.pending == self.value:
+            return False
+
+        if self.pending is None or self.value is None:
+            return True
+
+        db = self.deadband
+        elapsed = now - self.time
+
+        if elapsed >= db.max_silence:
+            return True
+
+        return elapsed >= db.interval and \
+            db.significant(self.value, self.pending)
+
+    def published(self, now):
+        self.value = self.pending
+        self.time = now
+
+def make_deadband(db):
+    """
+    Accepts a Deadband, a number, the absolute deadband, or a dict of
+    Deadband arguments.
+    """
+    if db is None or isinstance(db, Deadband):
+        return db
+    if isinstance(db, dict):
+        return Deadband(**db)
+    return Deadband(absolute=db)
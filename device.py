@@ -8,9 +8,18 @@ import traceback
 
 from settingsdevice import SettingsDevice
 from vedbus import VeDbusService, VeDbusItemImport, ServiceContext
+from vedbus import VeDbusTypedItemExport
 
 import __main__
-from register import Reg
+from airtime import PRIO_LOW, PRIO_NORMAL, PRIO_HIGH, PRIORITIES
+from breaker import CircuitBreaker
+from buspool import buspool
+from deadband import Limiter, make_deadband
+from identcache import identity_cache
+from latency import get_histogram
+from register import Reg, RegDecoder
+from poller import get_poller, release_pollers
+from publisher import publisher
 from utils import *
 
 import logging
@@ -20,6 +29,32 @@ class RegList(list):
     def __init__(self, access=None, regs=[]):
         super().__init__(regs)
         self.access = access
+        self.decoders = {}
+
+    def decoder(self, start, count):
+        """
+        Returns the decoder for a read of part of the list, compiled on
+        first use.
+        """
+        d = self.decoders.get((start, count))
+        if d is None:
+            d = self.decoders[(start, count)] = RegDecoder(self, start, count)
+        return d
+
+    def min_age(self):
+        return min(r.max_age for r in self)
+
+    def next_due(self):
+        """
+        Returns the time at which the first register goes stale.
+        """
+        return min(r.time + r.max_age for r in self)
+
+    def span(self):
+        return max(r.base + r.count for r in self) - self[0].base
+
+    def priority(self):
+        return max(r.priority for r in self)
 
 def modbus_overhead(method):
     overhead = 5 + 2                # request + response
@@ -33,44 +68,115 @@ def modbus_overhead(method):
 
     return overhead
 
+def percent(path, val):
+    return '%.1f%%' % val
+
+def milliseconds(path, val):
+    return '%.1f ms' % val if val is not None else '---'
+
 def contains_any(a, b, x):
     return any(a <= xx <= b for xx in x) if x else False
 
+def put_client(modbus):
+    modbus.put()
+    if modbus.refcount == 0:
+        # nothing left to poll, the worker threads are released
+        release_pollers(modbus)
+
+def plan_id(reg):
+    # the packing depends on the ages and priorities as well, a plan
+    # made before an override changed them no longer matches
+    return [reg.base, reg.count, reg.name, reg.max_age, reg.priority]
+
 def log_packed_reg(rgList):
     log.debug(f'Packed')
     for r in rgList:
         log.debug(f' base:0x{r.base:02x}, count:{r.count}, max_age:{r.max_age}')
 
-def pack_list(rr, access, hole_max, barrier):
+def merge_aliases(rr, aliases):
+    '''
+    Drops the registers of rr that decode the same words to the same value
+    as an earlier one, such as one register declared for both /Ac/Power and
+    /Ac/L1/Power.  Their paths are added to aliases under the path of the
+    register kept, which is then polled as often as the most demanding of
+    them.  Returns the remaining registers.
     '''
-    Takes a flat list of registeres in rr and packes it into a list or RegList objects
-    grouped so that the access and packing criteria are met.
-    Registers are packed to keep the maximum hole size to less than max_hole and 
-    not cross over a barrier, the maximum size of the RegList is limited to 125 registers.
+    kept = {}
+    regs = []
+
+    for r in rr:
+        same = None
+        if r.name:
+            for k in kept.get((r.base, r.count), ()):
+                if k.same_decode(r):
+                    same = k
+                    break
+
+        if same is None:
+            kept.setdefault((r.base, r.count), []).append(r)
+            regs.append(r)
+            continue
+
+        names = list(aliases.get(same.name, ()))
+        if r.name not in names and r.name != same.name:
+            aliases[same.name] = names + [r.name]
+
+        same.max_age = min(same.max_age, r.max_age)
+        same.priority = max(same.priority, r.priority)
+        log.debug('%s is an alias of %s', r.name, same.name)
 
+    return regs
 
-    When the registeres are processed, if any one of the registers has exceeded its max age, 
-    then all registers are updated.
+def pack_list(rr, access, hole_max, barrier, overhead):
+    '''
+    Takes a flat list of registers in rr and packs it into a list of RegList
+    objects, one per read, choosing the split that minimises the expected bus
+    traffic.
+
+    A read costs `overhead` bytes plus two for every register in its span,
+    holes included, and is repeated as often as its youngest max_age requires,
+    so registers polled at different rates end up in different reads unless
+    the extra request costs more than reading them together.  The optimum over
+    all splits in address order is found by dynamic programming.
+
+    A read never spans more than 125 registers, a hole larger than hole_max,
+    if set, or a barrier.
     '''
     rr.sort(key=lambda r: r.base)
+    n = len(rr)
 
-    regs = []
-    rg = RegList(access, [rr.pop(0)])
-    log.debug(f'Packing Registerers ')
-    for r in rr:
-        end = rg[-1].base + rg[-1].count
-        nr = r.base + r.count - rg[0].base
-        if nr > 125 or (r.base - end) > hole_max or \
-           contains_any(end, r.base, barrier):
-            log_packed_reg(rg)
-            regs.append(rg)
-            rg = RegList()
+    cost = [0] + [float('inf')] * n
+    split = [0] * (n + 1)
 
-        rg.append(r)
+    for i in range(n):
+        end = rr[i].base
+        min_age = float('inf')
 
-    if rg:
+        for j in range(i, n):
+            r = rr[j]
+            if j > i and (r.base + r.count - rr[i].base > 125 or
+                          (hole_max is not None and r.base - end > hole_max) or
+                          contains_any(end, r.base, barrier)):
+                break
+
+            end = max(end, r.base + r.count)
+            min_age = min(min_age, r.max_age)
+            c = cost[i] + (overhead + 2 * (end - rr[i].base)) / min_age
+
+            if c < cost[j + 1]:
+                cost[j + 1] = c
+                split[j + 1] = i
+
+    regs = []
+    j = n
+    log.debug('Packing registers')
+    while j > 0:
+        i = split[j]
+        regs.insert(0, RegList(access, rr[i:j]))
+        j = i
+
+    for rg in regs:
         log_packed_reg(rg)
-        regs.append(rg)
 
     return regs
 
@@ -96,18 +202,35 @@ class BaseDevice:
     vendor_id = None
     vendor_name = None
     device_type = None
+    # timeout until the turnaround of the unit is known, then it is
+    # twice the 99th percentile plus a margin, or doubled while more
+    # than 1% of the reads time out, kept within the floor and ceiling
     min_timeout = 0.1
+    timeout_floor = 0.05
+    timeout_ceiling = 2.0
+    timeout_samples = 20
+    read_margin = 0.05
+    # seconds between updates of the exported latency histogram
+    histogram_interval = 10
     refresh_time = None
     age_limit = 4
     age_limit_fast = 1
     fast_regs = ('/Ac/L1/Power', '/Ac/L2/Power', '/Ac/L3/Power', '/Ac/Power')
+    low_priority_age = 10
     allowed_roles = None
     default_access = 'holding'
     reg_hole_max = None
     reg_barrier = None
+    # roles with paths of their own, changing to or from them needs a
+    # full reinit rather than renaming the service
+    reinit_roles = ()
+    # Deadband, or absolute deadband, by path overriding the one of
+    # the register
+    deadbands = {}
 
     def __init__(self):
         self.role = None
+        self.poll_gen = 0
         self.info = {}
         self.dbus = None
         self._dbus = None
@@ -117,48 +240,94 @@ class BaseDevice:
         self.info_regs = []
         self.data_regs = []
         self.alias_regs = {}
+        self.limits = {}
+        self.held = set()
+        self.plan = None
+        self.overrides = {}
 
 
     def destroy(self):
+        # drops the polls still scheduled for the old register lists
+        self.poll_gen += 1
+        if self.dbus:
+            publisher.discard(self.dbus)
         if self._dbus:
+            conn = self._dbus.dbusconn
             self._dbus.__del__()
             self._dbus = None
+            buspool.release(conn)
         self.dbus = None
         if self.settings:
             self.settings._settings = None
             self.settings = None
 
+    def read_overhead(self):
+        """
+        Returns the cost of a read request in bytes, excluding data.
+        """
+        overhead = modbus_overhead(self.modbus.method)
+        if self.modbus.method == 'rtu':
+            overhead += 7           # 3.5 character gap after each frame
+        return overhead
+
     def pack_regs(self, regs):
         """
         Packs the supplied registers into a more efficient sequence
-        that reduces traffic on the bus.
-        It will also set the default access mechanism if not present, 
-        although there is a suspected bug here since only the first 
-        register gets the right value when set
+        that reduces traffic on the bus, separately for each access
+        type, registers without one use the default access.
+        The max_age of every register must be set.
         """
-        if self.reg_hole_max is not None:
-            hole_max = self.reg_hole_max
-        else:
-            hole_max = (modbus_overhead(self.modbus.method) + 1) // 2
-
-        regs = flatten(regs)
+        overhead = self.read_overhead()
 
         ra = {}
-        for r in regs:
+        for r in flatten(regs):
             ra.setdefault(r.access or self.default_access, []).append(r)
 
         rr = []
         for a, r in ra.items():
-            rr += pack_list(r, a, hole_max, self.reg_barrier)
+            rr += pack_list(r, a, self.reg_hole_max, self.reg_barrier,
+                            overhead)
 
         return rr
 
-    def read_modbus(self, start, count, access=None):
+    def read_timeout(self, count):
+        return self.timeout
+
+    def modbus_args(self, timeout=None):
+        """
+        Keyword arguments of a transaction with the unit.  Clients of
+        this package take the timeout per call, a pipelined one serves
+        the pollers of several units at once, pymodbus has it set.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if getattr(self.modbus, 'native', False):
+            return {'unit': self.unit, 'timeout': timeout}
+        self.modbus.timeout = timeout
+        return {'unit': self.unit}
+
+    def read_modbus(self, start, count, access=None, timeout=None):
         if access is None:
             access = self.default_access
 
         log.debug(f'Read from Register unit:{self.unit} {access} start:{start} count:{count}')
-        return self.modbus.read_registers(start, count, access, unit=self.unit)
+        t0 = time.time()
+        answered = False
+        try:
+            rr = self.modbus.read_registers(start, count, access,
+                                            **self.modbus_args(timeout))
+            answered = not rr.isError()
+            return rr
+        finally:
+            self.account(2 * count, time.time() - t0, answered)
+
+    def account(self, nbytes, elapsed, answered):
+        """
+        Charges a transaction carrying nbytes of register data to this
+        unit's share of the port.
+        """
+        nbytes += modbus_overhead(self.modbus.method)
+        self.poller.airtime.transaction(self.unit, nbytes, elapsed, answered)
 
     def read_register(self, reg):
         rr = self.read_modbus(reg.base, reg.count, reg.access)
@@ -170,11 +339,33 @@ class BaseDevice:
         reg.decode(rr.registers)
         return reg.value
 
+    def modbus_write(self, base, val):
+        args = self.modbus_args()
+        t0 = time.time()
+        answered = False
+        try:
+            if len(val) == 1:
+                rr = self.modbus.write_register(base, val[0], **args)
+            else:
+                rr = self.modbus.write_registers(base, val, **args)
+            answered = not rr.isError()
+            return rr
+        finally:
+            self.account(2 * len(val), time.time() - t0, answered)
+
+    def write_complete(self, base, rr, err):
+        if err is None and rr.isError():
+            err = rr
+        if err is not None:
+            self.log.error('Error writing register %#04x: %s', base, err)
+
     def write_modbus(self, base, val):
-        if len(val) == 1:
-            self.modbus.write_register(base, val[0], unit=self.unit)
-        else:
-            self.modbus.write_registers(base, val, unit=self.unit)
+        """
+        Queue a register write on the port's poller, the result is
+        only logged since the caller does not wait for it.
+        """
+        self.poller.submit(self.modbus_write, base, val,
+                           callback=partial(self.write_complete, base))
 
     def write_register(self, reg, val):
         reg.value = val
@@ -185,33 +376,62 @@ class BaseDevice:
             self.read_register(reg)
             d[reg.name] = reg
 
-    def read_data_regs(self, regs, d):
-        now = time.time()
+    def due_ranges(self, regs, now):
+        """
+        Returns the reads, as (start, count, registers), covering only
+        the registers of a packed list that are due.  Fresh registers
+        and holes between two due ones are read along when that costs
+        less than a separate request.
+        """
+        overhead = self.read_overhead()
+        ranges = []
 
-        if all(now - r.time < r.max_age for r in regs):
-            return
+        for r in regs:
+            if now - r.time < r.max_age:
+                continue
 
-        start = regs[0].base
-        count = regs[-1].base + regs[-1].count - start
+            end = r.base + r.count
+            if ranges and 2 * (r.base - ranges[-1][1]) < overhead:
+                start, rend, due = ranges[-1]
+                ranges[-1] = (start, max(rend, end), due + [r])
+            else:
+                ranges.append((r.base, end, [r]))
 
-        rr = self.read_modbus(start, count, regs.access)
+        return [(start, end - start, due) for start, end, due in ranges]
 
-        latency = time.time() - now
+    def read_size(self, regs, now):
+        """Bytes on the wire of the reads read_data_regs() makes now"""
+        overhead = modbus_overhead(self.modbus.method)
+        return sum(2 * count + overhead
+                   for start, count, due in self.due_ranges(regs, now))
 
-        if rr.isError():
-            raise Exception('Error reading registers %#04x-%#04x: %s' %
-                            (start, start + count - 1, rr))  # HERE
+    def read_data_regs(self, regs, d):
+        """
+        Reads the due registers of a packed list into d, returns the
+        turnaround of the unit: the time it took to answer the first
+        read less the time that read spent on the wire.
+        """
+        now = time.time()
+        latency = None
 
-        for reg in regs:
-            base = reg.base - start
-            end = base + reg.count
+        for start, count, due in self.due_ranges(regs, now):
+            t0 = time.time()
+            rr = self.read_modbus(start, count, regs.access,
+                                  self.read_timeout(count))
 
-            if now - reg.time > reg.max_age:
-                if reg.decode(rr.registers[base:end]) or not reg.time:
-                    if reg.name:
-                        d[reg.name] = reg.copy_if_valid()
-                reg.time = now
+            if latency is None:
+                nbytes = 2 * count + modbus_overhead(self.modbus.method)
+                wire = self.poller.airtime.transaction_time(nbytes)
+                latency = max(time.time() - t0 - wire, 0)
 
+            if rr.isError():
+                raise Exception('Error reading registers %#04x-%#04x: %s' %
+                                (start, start + count - 1, rr))  # HERE
+
+            decoder = regs.decoder(start, count)
+            for reg in decoder.decode(decoder.data(rr), now):
+                if reg.name:
+                    d[reg.name] = reg.value
 
         return latency
 
@@ -252,19 +472,41 @@ class BaseDevice:
 
         if name == 'instance':
             role, inst = self.get_role_instance()
+            old = self.role
+            self.role = role
+            self.devinst = inst
 
-            if role != self.role:
-                self.role = role
+            if role != old and not self.rename_service(old):
                 self.sched_reinit()
                 return True
 
             if self.dbus:
                 self.dbus['/DeviceInstance'] = inst
+                publisher.schedule(self.dbus)
 
             return True
 
         return False
 
+    def service_name(self):
+        return 'com.victronenergy.%s.%s' % (self.role, self.get_ident())
+
+    def rename_service(self, old_role):
+        """
+        Moves the D-Bus service to the name of the current role, keeping
+        its paths and the register plan.  Returns False if that is not
+        possible and the device needs a reinit.
+        """
+        if not self._dbus:
+            return False
+
+        if old_role in self.reinit_roles or self.role in self.reinit_roles:
+            return False
+
+        self._dbus.rename(self.service_name())
+        self.dbus['/Role'] = self.role
+        return True
+
     def add_settings(self, settings):
         """
         Adds a new setting
@@ -349,25 +591,19 @@ class BaseDevice:
 
         if name in self.dbus:
             del self.dbus[name]
-        v = r.copy_if_valid()
         if r.write:
             cb = partial(self.dbus_write_register, r)
-            self.dbus.add_path(name, v, writeable=True, onchangecallback=cb)
+            self.dbus.add_path(name, r.value, writeable=True,
+                               onchangecallback=cb, gettextcallback=r.dbus_text)
         else:
-            self.dbus.add_path(name, v)
+            self.dbus.add_path(name, r.value, gettextcallback=r.dbus_text)
 
         for alias in self.alias_regs.get(name, ()):
             self.dbus_add_reg_alias(r, alias)
 
     def dbus_add_reg_alias(self, r, name):
-        r.onchange = partial(self.dbus_update_alias, name, r.onchange)
         self.dbus_add_register(r, name)
 
-    def dbus_update_alias(self, name, onchange, reg):
-        if onchange:
-            onchange(reg)
-        self.dbus[name] = reg.copy_if_valid()
-
     def set_max_age(self, reg):
         """
         Set the maximum age of a register that has not been updated.
@@ -377,6 +613,42 @@ class BaseDevice:
         else:
             reg.max_age = self.age_limit
 
+    def path_overrides(self, name):
+        """
+        The overrides configured for a path and for its aliases, which
+        are published from the same register.
+        """
+        paths = [name] + list(self.alias_regs.get(name, ()))
+        return [self.overrides[p] for p in paths if p in self.overrides]
+
+    def apply_overrides(self, reg):
+        """
+        Applies the configured max_age and priority of the register's
+        path and aliases, the most demanding of them wins.  The deadband
+        is applied by set_deadband().
+        """
+        ovr = self.path_overrides(reg.name)
+        ages = [o['max_age'] for o in ovr if 'max_age' in o]
+        prios = [PRIORITIES.get(o['priority'], o['priority'])
+                 for o in ovr if 'priority' in o]
+
+        if ages:
+            reg.max_age = min(ages)
+        if prios:
+            reg.priority = max(prios)
+
+    def set_priority(self, reg):
+        """
+        Set the poll priority of a register that has none, slow
+        registers may be deferred when the bus is busy.
+        """
+        if reg.name in self.fast_regs:
+            reg.priority = PRIO_HIGH
+        elif reg.max_age >= self.low_priority_age:
+            reg.priority = PRIO_LOW
+        else:
+            reg.priority = PRIO_NORMAL
+
     def init_dbus(self):
         """
         INitialise the dbus, this will create a new dbus client starting 
@@ -387,10 +659,9 @@ class BaseDevice:
         It will set a refresh time if defined and add all info registers.
 
         """
-        ident = self.get_ident()
-
-        svcname = 'com.victronenergy.%s.%s' % (self.role, ident)
-        self._dbus = VeDbusService(svcname, private_bus())
+        svcname = self.service_name()
+        self._dbus = VeDbusService(svcname, buspool.service(svcname),
+                                   itemtype=VeDbusTypedItemExport)
         self.dbus = ServiceContext(self._dbus)
 
         self.dbus.add_path('/Mgmt/ProcessName', __main__.NAME)
@@ -412,6 +683,22 @@ class BaseDevice:
         if self.refresh_time is not None:
             self.dbus.add_path('/RefreshTime', self.refresh_time)
 
+        self.dbus.add_path('/Mgmt/BusUtilisation', 0, gettextcallback=percent)
+        self.dbus.add_path('/Mgmt/PortUtilisation', 0, gettextcallback=percent)
+        self.dbus.add_path('/Mgmt/Breaker/State', self.breaker.state,
+                           gettextcallback=self.breaker.state_text)
+        self.dbus.add_path('/Mgmt/Breaker/Failures', self.breaker.failures)
+        self.dbus.add_path('/Mgmt/Breaker/Trips', self.breaker.trips)
+        self.dbus.add_path('/Mgmt/Breaker/Probes', self.breaker.probes)
+        self.dbus.add_path('/Mgmt/Timeout', 1000 * self.timeout,
+                           gettextcallback=milliseconds)
+        self.dbus.add_path('/Mgmt/Latency/P50', None,
+                           gettextcallback=milliseconds)
+        self.dbus.add_path('/Mgmt/Latency/P99', None,
+                           gettextcallback=milliseconds)
+        self.dbus.add_path('/Mgmt/Latency/Failures', 0)
+        self.dbus.add_path('/Mgmt/Latency/Histogram', [])
+
         for p in self.info:
             self.dbus_add_register(self.info[p])
 
@@ -419,32 +706,164 @@ class BaseDevice:
         """
         Adds the data registers after packing them
         """
-        self.data_regs = self.pack_regs(self.data_regs)
+        regs = flatten(self.data_regs)
+
+        for rr in regs:
+            self.apply_overrides(rr)
+            if rr.max_age is None:
+                self.set_max_age(rr)
+            if rr.priority is None:
+                self.set_priority(rr)
+
+        regs = merge_aliases(regs, self.alias_regs)
+        self.data_regs = self.plan_regs(regs) or self.pack_regs(regs)
+
+        self.limits = {}
+        self.held = set()
 
         for r in self.data_regs:
+            r.decoder(r[0].base, r.span())
             for rr in r:
-                if rr.max_age is None:
-                    self.set_max_age(rr)
                 if rr.name:
                     self.dbus_add_register(rr)
+                    self.set_deadband(rr)
 
-    def update_data_regs(self):
+    def plan_regs(self, regs):
+        """
+        Rebuilds the packed lists from a cached plan, returns None if
+        there is none or it does not match the registers.
+        """
+        if not self.plan:
+            return None
+
+        ident = {tuple(plan_id(r)): r for r in regs}
+        if len(ident) != len(regs):
+            return None
+
+        packed = []
+        for access, ids in self.plan:
+            rl = RegList(access, [ident.pop(tuple(i), None) for i in ids])
+            # not `None in rl`, a register without a value equals None
+            if not rl or any(r is None for r in rl):
+                return None
+            packed.append(rl)
+
+        if ident:
+            return None
+
+        return packed
+
+    def get_plan(self):
+        return [[r.access, [plan_id(rr) for rr in r]]
+                for r in self.data_regs]
+
+    def set_deadband(self, reg):
+        db = self.deadbands.get(reg.name, reg.deadband)
+        # the path's own override comes first, the aliases share it
+        for o in reversed(self.path_overrides(reg.name)):
+            db = o.get('deadband', db)
+        db = make_deadband(db)
+        if db is not None:
+            self.limits[reg.name] = Limiter(db)
+
+    def start_polling(self):
         """
-        Reads all the data registers from the mobus client
-        Note these may have been packed into groups to reduce
-        modbus traffic volumes.
+        Schedules every packed register list on the port's poller,
+        each one is then read when its first register goes stale.
         """
-        latency = []
+        now = time.time()
+        for regs in self.data_regs:
+            self.poller.submit(self.poll_regs, regs, self.poll_gen,
+                               when=now,
+                               callback=partial(self.poll_complete,
+                                                self.poll_gen))
 
-        for r in self.data_regs:
-            t = self.read_data_regs(r, self.dbus)
-            if t:
-                latency.append(t)
+    def poll_regs(self, regs, gen):
+        """
+        Reads one register list and schedules its next read, runs on
+        the poller thread.  Returns the changed values by path and the
+        unit's turnaround.
+        """
+        if gen != self.poll_gen:
+            return None
+
+        if self.breaker.park(partial(self.resume_regs, regs, gen)):
+            # the unit does not answer, polled again once it does
+            return None
+
+        nbytes = self.read_size(regs, time.time())
+        if not self.poller.airtime.admit(nbytes, regs.priority()):
+            # the bus budget of this cycle is used up, try the next one
+            self.poller.submit(self.poll_regs, regs, gen,
+                               when=self.poller.airtime.next_cycle(),
+                               callback=partial(self.poll_complete, gen))
+            return None
+
+        failed = True
+        try:
+            changes = {}
+            latency = self.read_data_regs(regs, changes)
+            failed = False
+            return changes, latency
+        finally:
+            when = self.next_poll(regs, failed)
+            self.poller.submit(self.poll_regs, regs, gen,
+                               when=when,
+                               callback=partial(self.poll_complete, gen))
+
+    def resume_regs(self, regs, gen):
+        self.poller.submit(self.poll_regs, regs, gen,
+                           callback=partial(self.poll_complete, gen))
+
+    def next_poll(self, regs, failed):
+        if failed:
+            return time.time() + regs.min_age()
+        return regs.next_due()
+
+    def poll_complete(self, gen, result, err):
+        if gen != self.poll_gen:
+            # submitted before a destroy or reinit
+            return
+        if result is None or err is not None:
+            return
+        self.polled = result
+        self.device_update()
+        self.post_update()
 
-        return latency
+    def publish(self, changes):
+        """
+        Applies polled values to the D-Bus service, runs on the main loop.
+        Values of paths with a deadband are held back until significant.
+        """
+        now = time.time()
+
+        for name, v in changes.items():
+            lim = self.limits.get(name)
+            if lim is not None:
+                if not lim.offer(v, now):
+                    if v != lim.value:
+                        self.held.add(name)
+                    else:
+                        self.held.discard(name)
+                    continue
+                lim.published(now)
+                self.held.discard(name)
+            self.publish_value(name, v)
+
+        for name in list(self.held):
+            lim = self.limits[name]
+            if lim.ready(now):
+                lim.published(now)
+                self.held.discard(name)
+                self.publish_value(name, lim.value)
+
+    def publish_value(self, name, v):
+        self.dbus[name] = v
+        for alias in self.alias_regs.get(name, ()):
+            self.dbus[alias] = v
 
     def post_update(self):
-        self.dbus.flush()
+        publisher.schedule(self.dbus)
 
 
 
@@ -467,14 +886,21 @@ class ModbusDevice(BaseDevice):
         super().__init__()
         self.spec = spec
         self.modbus = modbus.get()
+        self.modbus_held = True
+        self.poller = get_poller(self.modbus, spec.unit)
         self.unit = spec.unit
         self.model = model
         self.subdevices = []
         self.latency = modbus.timeout
+        self.timeout = self.min_timeout
+        self.latency_hist = get_histogram(str(spec))
+        self.histogram_time = 0
         self.need_reinit = False
         self.init_done = False  # initialisation has been done
+        self.busy = False       # a job is queued on the poller
+        self.polled = None      # result of the last poll
         self.next_init = time.time() # time after which next init can start
-        self.next_retry_at = self.next_init # if update is failing retry at this time
+        self.breaker = CircuitBreaker()
         self.log = logging.getLogger(str(self))
         self.log.addFilter(self)
         self.update_count = 0
@@ -494,7 +920,21 @@ class ModbusDevice(BaseDevice):
 
         super().destroy()
         self.info.clear()
-        self.modbus.put()
+        self.plan = None
+        self.init_done = False
+        self.put_modbus()
+
+    def hold_modbus(self):
+        if not self.modbus_held:
+            self.modbus_held = True
+            self.modbus.get()
+
+    def put_modbus(self):
+        # a disabled device retrying its init must not put it again
+        if not self.modbus_held:
+            return
+        self.modbus_held = False
+        put_client(self.modbus)
 
     def __eq__(self, other):
         return str(self) == str(other)
@@ -509,10 +949,7 @@ class ModbusDevice(BaseDevice):
         """
         Returns a string representing the modbus connection details.
         """
-        if self.modbus.method == 'tcp':
-            return 'Modbus %s %s' % (self.modbus.method.upper(),
-                                     self.modbus.socket.getpeername()[0])
-        elif self.modbus.method == 'udp':
+        if self.modbus.method in ['tcp', 'udp']:
             return 'Modbus %s %s' % (self.modbus.method.upper(),
                                      self.modbus.host)
         elif self.modbus.method in ['rtu', 'ascii']:
@@ -558,37 +995,234 @@ class ModbusDevice(BaseDevice):
         return False
 
     def reinit(self):
-        self.modbus.get()
+        # keeps the client open across the destroy
+        modbus = self.modbus.get()
         self.destroy()
-        self.init(self.settings_dbus, self.enabled)
         self.need_reinit = False
+        self.init(self.settings_dbus, self.enabled)
+        put_client(modbus)
 
     def sched_reinit(self):
         self.need_reinit = True
 
     def init(self, dbus, enable=True):
+        """
+        Starts the initialisation if due.  The info registers are read,
+        or taken from the identity cache, on the poller thread and
+        init_complete() creates the D-Bus service once they are in.
+        Returns True when the device is initialised.
+        """
         if self.init_done:
             return True
+        if self.busy:
+            return False
         now = time.time()
+        if now - self.next_init < 0:
+            return False
+        log.debug(f'Try init unit:{self.unit}')
+        self.enabled = enable
+        # the client and poller are released while the unit is disabled
+        self.hold_modbus()
+        self.poller = get_poller(self.modbus, self.unit)
+        self.busy = True
+
+        entry = identity_cache.get(self.spec, self.model)
+        if entry is not None and self.info_regs:
+            self.poller.submit(self.init_cached, self.poll_gen, entry,
+                               callback=partial(self.cached_complete, dbus,
+                                                self.poll_gen, entry))
+        else:
+            self.submit_probe(dbus, self.poll_gen)
+        return False
+
+    def submit_probe(self, dbus, gen):
+        self.poller.submit(self.probe, gen,
+                           callback=partial(self.init_complete, dbus, gen))
+
+    def init_cached(self, gen, entry):
+        """
+        Sets up the device from the cached identity of the unit, runs
+        on the poller thread as device_init() of some drivers reads
+        registers.  Returns False if the entry is not usable.
+        """
+        if gen != self.poll_gen:
+            return None
+
         try:
-            if now - self.next_init < 0:
-                return False
-            log.debug(f'Try init unit:{self.unit}')
-            self.enabled = enable
-            self.modbus.timeout = self.timeout
+            for reg in self.info_regs:
+                reg.value = entry['info'][reg.name]
+                self.info[reg.name] = reg
+            self.device_init()
+        except Exception:
+            self.info.clear()
+            return False
+
+        if self.subdevices:
+            self.info.clear()
+            return False
+
+        return True
+
+    def cached_complete(self, dbus, gen, entry, result, err):
+        """
+        Creates the service from the cached identity without waiting
+        for the unit to answer, the info registers are read again in
+        the background to verify it.  Without a usable entry the unit
+        is probed as usual.
+        """
+        self.busy = False
+        if gen != self.poll_gen:
+            return
+
+        if not result:
+            self.busy = True
+            self.submit_probe(dbus, gen)
+            return
+
+        self.plan = entry['plan']
+        self.cached_info = entry['info']
+        log.info(f'Using cached identity unit:{self.unit}')
+        self.init_complete(dbus, gen, None, None)
+
+        if self.init_done:
+            self.submit_verify(gen)
+
+    def submit_verify(self, gen, when=0):
+        self.poller.submit(self.verify_identity, gen, self.cached_info,
+                           when=when, callback=partial(self.verify_complete,
+                                                       gen))
+
+    def verify_identity(self, gen, info):
+        """
+        Reads the info registers and compares them with the cached
+        values, runs on the poller thread.
+        """
+        if gen != self.poll_gen:
+            return None
+
+        if self.breaker.park(partial(self.submit_verify, gen)):
+            # checked once the unit answers again
+            return None
+
+        overhead = modbus_overhead(self.modbus.method)
+        nbytes = sum(2 * reg.count + overhead for reg in self.info_regs)
+        if not self.poller.airtime.admit(nbytes, PRIO_LOW):
+            self.submit_verify(gen, self.poller.airtime.next_cycle())
+            return None
+
+        for reg in self.info_regs:
+            self.read_register(reg)
+
+        return all(reg.value == info.get(reg.name) for reg in self.info_regs)
+
+    def verify_complete(self, gen, result, err):
+        if gen != self.poll_gen:
+            # the service was destroyed or reinitialised meanwhile
+            return
+
+        if err is not None:
+            # not answering yet, try again when it might
+            when = max(self.breaker.next_probe,
+                       time.time() + CircuitBreaker.backoff_min)
+            self.submit_verify(gen, when)
+            return
+
+        if result is False:
+            self.log.info('Identity changed, reinitialising')
+            identity_cache.drop(self.spec)
+            self.sched_reinit()
+
+    def save_identity(self):
+        if self.subdevices:
+            return
+        info = {reg.name: reg.value for reg in self.info_regs}
+        identity_cache.put(self.spec, self.model, info, self.get_plan())
+
+    def probe(self, gen):
+        """
+        Reads everything needed to create the service, runs on the
+        poller thread.  A unit that did not answer before is first
+        checked with a single register read.
+        """
+        if gen != self.poll_gen:
+            return None
+
+        try:
+            if not self.breaker.closed():
+                self.breaker.probe()
+                self.probe_read()
+
             self.device_init()
             self.read_info()
+
+            for s in self.subdevices:
+                s.probe()
+        except:
+            self.breaker.failure()
+            raise
+
+        self.breaker.success()
+
+    def probe_read(self):
+        """
+        Reads a single register to check whether the unit answers.
+        """
+        reg = (self.info_regs or flatten(self.data_regs))[0]
+        rr = self.read_modbus(reg.base, 1, reg.access)
+        if rr.isError():
+            raise Exception(rr)
+
+    def schedule_probe(self):
+        self.poller.submit(self.probe_unit, self.poll_gen,
+                           when=self.breaker.next_probe,
+                           callback=self.probe_complete)
+
+    def probe_unit(self, gen):
+        """
+        Probes a unit while its breaker is open, runs on the poller
+        thread.  Closing the breaker resumes the parked polls.
+        """
+        if gen != self.poll_gen:
+            return None
+
+        self.breaker.probe()
+        try:
+            self.probe_read()
+        except:
+            if self.breaker.failure():
+                self.schedule_probe()
+            raise
+
+        self.last_seen = time.time()
+        self.breaker.success()
+        return True
+
+    def probe_complete(self, result, err):
+        if not self.init_done:
+            return
+        self.update_mgmt()
+        publisher.schedule(self.dbus)
+
+    def init_complete(self, dbus, gen, result, err):
+        self.busy = False
+        if gen != self.poll_gen:
+            # destroyed meanwhile
+            return
+        try:
+            if err:
+                raise err
+
             self.init_device_settings(dbus)
             self.need_reinit = False
 
             if not self.enabled:
-                self.modbus.put()
+                self.put_modbus()
                 return
 
+            self.update_timeout()
             self.init_dbus()
             self.init_data_regs()
 
-            self.latfilt = LatencyFilter(self.latency)
             self.device_init_late()
             self.need_reinit = False
 
@@ -597,41 +1231,55 @@ class ModbusDevice(BaseDevice):
             for s in self.subdevices:
                 s.init()
             self.init_done = True
+            self.save_identity()
+
+            self.start_polling()
+            for s in self.subdevices:
+                s.start_polling()
             log.info(f'Suceess init unit:{self.unit}')
-            return True
-        except Exception as err:
-            # wait 60s before retrying init.
-            self.next_init = now + 60
+        except Exception as ex:
+            # retry when the breaker allows the next probe
+            self.next_init = max(self.breaker.next_probe,
+                                 time.time() + CircuitBreaker.backoff_min)
             self.init_fail_count = self.init_fail_count + 1
             log.debug(f'Fail init unit:{self.unit}')
 # temp removed            traceback.print_exc()
-            return False
-
 
     def update(self):
+        if self.need_reinit:
+            self.reinit()
+
+    def next_poll(self, regs, failed):
+        due = super().next_poll(regs, failed)
+        if not failed:
+            self.last_seen = time.time()
+            self.breaker.success()
+        elif self.breaker.failure():
+            log.debug(f'Breaker open unit {self.unit}')
+            self.schedule_probe()
+        return due
+
+    def poll_complete(self, gen, result, err):
+        if gen != self.poll_gen:
+            # submitted before a destroy or reinit, the results do not
+            # belong to the current service
+            return
+        if result is None and err is None:
+            # dropped, the register list belongs to a destroyed service
+            return
+        if not self.init_done:
+            return
+
+        self.update_count = self.update_count + 1
         try:
-            if self.need_reinit:
-                self.reinit()
+            if err:
+                # a unit answering with an error did keep its timeout
+                self.latency_hist.failed('No Response' in str(err))
+                self.update_timeout()
+                raise err
 
-            if not self.enabled:
-                return
-            now = time.time()
-            if now - self.last_seen > 30:
-                # currently failing, see if a retry delay has passed
-                if now - self.next_retry_at < 0:
-                    return
-                # can retry, so updatee the next_retry_at time 
-                # if there are no further failures normall polling will continue
-                log.debug(f'Retry update unit {self.unit}')
-                self.next_retry_at = now + 60
-
-
-            self.update_count = self.update_count + 1      
-            self.modbus.timeout = self.timeout
+            self.polled = result
             self.device_update()    # HERE
-            self.post_update()
-            # reset the timeout markers
-            self.last_seen = time.time()
             self.update_sucess = self.update_sucess + 1
             if self.in_fail_state:
                 self.in_fail_state = False
@@ -643,21 +1291,70 @@ class ModbusDevice(BaseDevice):
                     self.in_fail_state = True
                     log.info(f'Device {self.model} on unit {self.unit} offline cause:{ex}')
 
+        self.update_mgmt()
+        self.post_update()
+
+    def update_mgmt(self):
+        airtime = self.poller.airtime
+        self.dbus['/Mgmt/BusUtilisation'] = round(airtime.utilisation(self.unit), 1)
+        self.dbus['/Mgmt/PortUtilisation'] = round(airtime.utilisation(), 1)
+        self.dbus['/Mgmt/Breaker/State'] = self.breaker.state
+        self.dbus['/Mgmt/Breaker/Failures'] = self.breaker.failures
+        self.dbus['/Mgmt/Breaker/Trips'] = self.breaker.trips
+        self.dbus['/Mgmt/Breaker/Probes'] = self.breaker.probes
+
+        hist = self.latency_hist
+        self.dbus['/Mgmt/Timeout'] = round(1000 * self.timeout, 1)
+        for p in (50, 99):
+            latency = hist.percentile(p)
+            if latency is not None:
+                latency = round(1000 * latency, 1)
+            self.dbus['/Mgmt/Latency/P%d' % p] = latency
+        self.dbus['/Mgmt/Latency/Failures'] = hist.failures
 
+        now = time.time()
+        if now - self.histogram_time >= self.histogram_interval:
+            self.histogram_time = now
+            self.dbus['/Mgmt/Latency/Histogram'] = hist.buckets()
 
     def print_metrics(self):
-        log.info(f'status unit:{self.unit} init_fail:{self.init_fail_count} updates:{self.update_count} sucess:{self.update_sucess} fail:{self.update_count - self.update_sucess}')
+        airtime = self.poller.airtime
+        log.info(f'status unit:{self.unit} init_fail:{self.init_fail_count} updates:{self.update_count} sucess:{self.update_sucess} fail:{self.update_count - self.update_sucess} bus:{airtime.utilisation(self.unit):.1f}% port:{airtime.utilisation():.1f}% deferred:{airtime.deferred} breaker:{self.breaker.state_text()} trips:{self.breaker.trips}')
 
-    def device_update(self):
-        latency = self.update_data_regs()  #HERE
+    def read_timeout(self, count):
+        """
+        Timeout of a read of count registers: its wire time at the
+        port's rate plus the device timeout for the turnaround.
+        """
+        nbytes = 2 * count + modbus_overhead(self.modbus.method)
+        return self.poller.airtime.transaction_time(nbytes) + self.timeout
 
-        for s in self.subdevices:
-            s.device_update()
-            s.post_update()
+    def update_timeout(self):
+        """
+        Sets the timeout from the 99th percentile of the turnaround,
+        once enough of it has been seen.
+        """
+        hist = self.latency_hist
+        if hist.samples() < self.timeout_samples:
+            return
+
+        latency = hist.percentile(99)
+        if latency is None:
+            # too many reads time out, the timeout is too short
+            timeout = 2 * self.timeout
+        else:
+            self.latency = latency
+            timeout = 2 * latency + self.read_margin
+        self.timeout = min(max(timeout, self.timeout_floor),
+                           self.timeout_ceiling)
+
+    def device_update(self):
+        changes, latency = self.polled
+        self.publish(changes)
 
-        if latency:
-            self.latency = self.latfilt.filter(latency)
-            self.timeout = max(self.min_timeout, self.latency * 4)
+        if latency is not None:
+            self.latency_hist.add(latency)
+            self.update_timeout()
 
     def set_enabled(self, enabled):
         if enabled == self.enabled:
@@ -665,8 +1362,6 @@ class ModbusDevice(BaseDevice):
 
         self.enabled = enabled
         self.settings['enabled'] = enabled
-        if enabled:
-            self.modbus.get()
         self.sched_reinit()
 
 class SubDevice(BaseDevice):
@@ -682,6 +1377,7 @@ class SubDevice(BaseDevice):
         self.subid = subid
         self.modbus = parent.modbus
         self.unit = parent.unit
+        self.polled = None
         self.default_access = parent.default_access
         self.model = parent.model
         self.productid = parent.productid
@@ -694,10 +1390,11 @@ class SubDevice(BaseDevice):
     def get_ident(self):
         return self.parent.get_ident() + '_%s' % self.subid
 
-    def init(self):
+    def probe(self):
         self.device_init()
         self.read_info()
 
+    def init(self):
         for i in self.inherit_info:
             if i in self.parent.info:
                 self.info.setdefault(i, self.parent.info[i])
@@ -711,29 +1408,27 @@ class SubDevice(BaseDevice):
     def sched_reinit(self):
         self.parent.sched_reinit()
 
-    def device_update(self):
-        self.update_data_regs()
+    @property
+    def timeout(self):
+        return self.parent.timeout
 
-class LatencyFilter:
-    def __init__(self, val):
-        self.length = 8
-        self.pos = 0
-        self.val = val
-        self.values = [val] * self.length
+    def read_timeout(self, count):
+        return self.parent.read_timeout(count)
 
-    def filter(self, values):
-        self.values[self.pos] = max(values)
-        self.pos += 1
-        self.pos &= self.length - 1
+    @property
+    def breaker(self):
+        return self.parent.breaker
 
-        val = max(self.values)
+    @property
+    def poller(self):
+        return self.parent.poller
 
-        if val > self.val:
-            self.val = 0.25 * self.val + 0.75 * val
-        else:
-            self.val = 0.75 * self.val + 0.25 * val
+    def next_poll(self, regs, failed):
+        return self.parent.next_poll(regs, failed)
 
-        return self.val
+    def device_update(self):
+        changes, latency = self.polled
+        self.publish(changes)
 
 class CustomName:
     def device_init_late(self):
@@ -799,6 +1494,7 @@ class EnergyMeter(ModbusDevice):
     default_instance = 40
     nr_phases = None
     position = None
+    reinit_roles = ('pvinverter',)
 
     def device_init_late(self):
         super().device_init_late()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Registry of the device drivers.
+
+The probe handlers of every driver are described in an index, built
+once with `python3 drivers.py`, holding the model IDs, methods, units
+and rates of each handler and the module providing it.  Stand-ins for
+the handlers are registered with probe from the index at startup, a
+driver module is only imported when a device needs it: when it is
+configured by model name or when one of its handlers has to probe.
+"""
+
+import importlib
+import json
+import logging
+import os
+import sys
+
+import probe
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'drivers.json')
+
+# drivers no longer maintained, importable when installed next to this
+# file or from the archive directory of the source tree
+ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')
+
+MODULES = [
+    'eastron_sdm230',
+    'growatt_pv_v120',
+    'abb',
+    'carlo_gavazzi',
+    'comap',
+    'cre',
+    'deif',
+    'dse',
+    'ev_charger',
+    'smappee',
+    'victron_em',
+]
+
+index = []
+loaded = {}
+
+class LazyHandler:
+    """
+    Stands in for the probe handlers of one driver module, which is
+    imported on the first probe.
+    """
+
+    def __init__(self, entry):
+        self.module = entry['module']
+        self.methods = entry['methods']
+        self.units = entry['units']
+        self.rates = entry['rates']
+        self.models = entry['models']
+
+    def probe(self, spec, modbus, timeout=None):
+        for t in load(self.module):
+            if t.methods and spec.method not in t.methods:
+                continue
+            d = t.probe(spec, modbus, timeout)
+            if d:
+                return d
+
+        return None
+
+    def get_models(self):
+        return [(m['vendor'], m['type'], m['model'])
+                for m in self.models.values()]
+
+def load(module):
+    """
+    Imports a driver module and returns its probe handlers, which are
+    kept out of probe.device_types since the stand-in is there.
+    """
+    if module in loaded:
+        return loaded[module]
+
+    if os.path.isdir(ARCHIVE) and ARCHIVE not in sys.path:
+        sys.path.append(ARCHIVE)
+
+    before = list(probe.device_types)
+    importlib.import_module(module)
+    handlers = [t for t in probe.device_types if t not in before]
+
+    for t in handlers:
+        probe.device_types.remove(t)
+
+    log.info('Loaded driver %s', module)
+    loaded[module] = handlers
+    return handlers
+
+def load_index(path=INDEX_FILE):
+    global index
+
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except Exception as ex:
+        log.error('Failed to read driver index %s: %s', path, ex)
+        index = []
+
+def register():
+    """Registers the stand-in handlers of all indexed drivers"""
+    if not index:
+        load_index()
+
+    for entry in index:
+        probe.add_handler(LazyHandler(entry))
+
+def find(model):
+    for entry in index:
+        for m in entry['models'].values():
+            if m['model'] == model:
+                return entry['module']
+
+    raise KeyError('Unknown model %s' % model)
+
+def handler_class(model):
+    """Returns the device class of a model, importing its driver"""
+    if not index:
+        load_index()
+
+    for t in load(find(model)):
+        for m in t.models.values():
+            if m['model'] == model:
+                return m['handler']
+
+    raise KeyError('Model %s not found in %s' % (model, find(model)))
+
+def create(model, spec, modbus):
+    return handler_class(model)(spec, modbus, model)
+
+def get_models():
+    if not index:
+        load_index()
+
+    m = []
+    for entry in index:
+        m += LazyHandler(entry).get_models()
+
+    return m
+
+def build(modules=MODULES, path=INDEX_FILE):
+    """Imports every driver and writes the index of their handlers"""
+    entries = []
+
+    for module in modules:
+        try:
+            handlers = load(module)
+        except Exception as ex:
+            log.error('Skipping driver %s: %s', module, ex)
+            continue
+
+        for t in handlers:
+            entries.append({
+                'module': module,
+                'methods': list(t.methods),
+                'units': list(t.units),
+                'rates': list(t.rates),
+                'models': {
+                    str(k): {
+                        'model': v['model'],
+                        'vendor': v['handler'].vendor_name,
+                        'type': v['handler'].device_type,
+                    } for k, v in t.models.items()
+                },
+            })
+
+    with open(path, 'w') as f:
+        json.dump(entries, f, indent=1)
+        f.write('\n')
+
+    log.info('Wrote %d handlers to %s', len(entries), path)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build(sys.argv[1:] or MODULES)
@@ -17,21 +17,12 @@
 import logging
 import device
 import probe
+import regmap
 from register import *
-from utils import private_bus
-from vedbus import VeDbusItemImport
 
 log = logging.getLogger(__name__)
 
-
-
-#
-# Eastron use 32 bit floats in IEE 754 format.
-class Reg_f32b(Reg_num):
-    count = 2
-    coding = ('>f', '>2H')
-    rtype = float
-        
+REGMAP = 'eastron_sdm230.json'
 
 
 class Eastron_SDM230v2(device.EnergyMeter,device.CustomName):
@@ -46,9 +37,10 @@ class Eastron_SDM230v2(device.EnergyMeter,device.CustomName):
     default_role = 'grid'
     default_instance = 40
     nr_phases = None
-    # Group the registeres by their max age by introducing barriers to the packing.
-    # 
-    reg_barrier = ( 0x12, 0x46, 0x156 )
+    deadbands = {
+        '/Ac/Voltage': 0.1,
+        '/Ac/Frequency': 0.01,
+    }
 
     def __init__(self, *args):
         super(Eastron_SDM230v2, self).__init__(*args)
@@ -56,11 +48,7 @@ class Eastron_SDM230v2(device.EnergyMeter,device.CustomName):
 
         # see page 23 in https://www.eastroneurope.com/images/uploads/products/manuals/SDM630MCT-ML_User_manual_V1.2.pdf
         # seems to be correct for a SDM203 also.
-        self.info_regs = [
-            Reg_u16( 0xfc02,  '/HardwareVersion', access='holding'),   # using the model number here, since it appears to work
-            Reg_u16( 0xfc03, '/FirmwareVersion', access='holding'),   # 630 and 120 use this location.
-            Reg_u32b( 0xfc00, '/Serial', access='holding'),
-        ]
+        self.info_regs = regmap.load(REGMAP).info_regs()
 
 
 
@@ -81,6 +69,10 @@ class Eastron_SDM230v2(device.EnergyMeter,device.CustomName):
         super().device_update()
 
         # only implement single phase for the moment, because this is a single phase meter.
+        # the energy registers are polled separately and may not be in yet.
+        if self.dbus['/Ac/L1/Energy/Forward'] is None or \
+           self.dbus['/Ac/L1/Energy/Reverse'] is None:
+            return
         importedEnergy = float(self.dbus['/Ac/L1/Energy/Forward'])
         exportedEnergy = float(self.dbus['/Ac/L1/Energy/Reverse'])
         consumption = importedEnergy - exportedEnergy
@@ -89,48 +81,12 @@ class Eastron_SDM230v2(device.EnergyMeter,device.CustomName):
 
 
 
-    def phase_regs(self, n):
-        s = 0x0002 * (n - 1)
-        return [
-            Reg_f32b(0x0000 + s, '/Ac/L%d/Voltage' % n,        1, '%.1f V', max_age=0.28),
-            Reg_f32b(0x0006 + s, '/Ac/L%d/Current' % n,        1, '%.1f A', max_age=0.28),
-            Reg_f32b(0x000c + s, '/Ac/L%d/Power' % n,          1, '%.1f W', max_age=0.28),
-            Reg_f32b(0x0048 + s, '/Ac/L%d/Energy/Forward' % n, 1, '%.1f kWh', max_age=15),
-            Reg_f32b(0x004a + s, '/Ac/L%d/Energy/Reverse' % n, 1, '%.1f kWh', max_age=15),
-        ]
-
     def device_init(self):
 
         self.read_info()
 
-        phases = 1
-
-        regs = [
-            Reg_f32b(0x0000, '/Ac/Voltage',        1, '%.1f V', max_age=0.28),
-            Reg_f32b(0x0006, '/Ac/Current',        1, '%.1f A', max_age=0.28),
-            Reg_f32b(0x000c, '/Ac/Power',          1, '%.1f W', max_age=0.28),
-
-            Reg_f32b(0x0012, '/Ac/ApparentPower',  1, '%.1f W', max_age=5),
-            Reg_f32b(0x0018, '/Ac/ReactivePower',  1, '%.1f VAr', max_age=5),
-            Reg_f32b(0x001E, '/Ac/PowerFactor',    1, '%.1f', max_age=5),
-
-            Reg_f32b(0x0046, '/Ac/Frequency',      1, '%.1f Hz', max_age=15),
-            Reg_f32b(0x0048, '/Ac/Energy/Forward', 1, '%.1f kWh', max_age=15),
-            Reg_f32b(0x004a, '/Ac/Energy/Reverse', 1, '%.1f kWh', max_age=15),
-            Reg_f32b(0x004c, '/Ac/Energy/ReactiveForward', 1, '%.1f VAhr', max_age=15),
-            Reg_f32b(0x004e, '/Ac/Energy/ReactiveReverse', 1, '%.1f VAhr', max_age=15),
-
-            Reg_f32b(0x0156, '/Ac/Energy/Total', 1, '%.1f kWh', max_age=30),
-            Reg_f32b(0x0158, '/Ac/Energy/ReactiveTotal', 1, '%.1f VAhr', max_age=30),
-
-        ]
-
-
-
-        for n in range(1, phases + 1):
-            regs += self.phase_regs(n)
-
-        self.data_regs = regs
+        # single phase, the L1 paths are aliases of the totals
+        self.data_regs = regmap.load(REGMAP).data_regs(self.alias_regs)
 
     def get_ident(self):
         return 'cg_%s' % self.info['/Serial']
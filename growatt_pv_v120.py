@@ -21,7 +21,7 @@ import math
 from register import *
 import time
 from vedbus import weak_functor
-from utils import private_bus
+from buspool import buspool
 from ve_utils import unwrap_dbus_value
 
 import logging
@@ -62,6 +62,7 @@ G100_FAIL_SAFE = {
 
 
 class Reg_equalsu16(Reg_u16):
+    __slots__ = ('trueValue', 'falseValue', 'matchValue')
     count = 1
 
     def __init__(self, base, name, matchValue, trueValue=1, falseValue=0, **kwargs):
@@ -186,6 +187,7 @@ class GrowattPVInverter(device.ModbusDevice, device.CustomName):
             self.batterySocTracker.__del__()
             self.batterySocTracker = None
         '''
+        super().destroy()
 
     '''
     '''
@@ -257,7 +259,7 @@ class GrowattPVInverter(device.ModbusDevice, device.CustomName):
             or self.batteryTracker == None 
             or self.systemTracker == None
             or self.vebusTracker == None):
-            dbusConn = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
+            dbusConn = buspool.shared()
             dbusObjects = {}
             dbusNames = dbusConn.list_names()
             gridServiceName = None
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+CACHE_FILE = '/data/var/lib/dbus-modbus-client/identity.json'
+
+class IdentityCache:
+    """
+    Remembers the identity of each unit across restarts.
+
+    Entries are keyed by the device spec and hold the model, the values
+    of the info registers and the packed register plan, so the service
+    of a known unit can be created at boot before the unit answers.
+    The file is only rewritten when an entry changes.
+    """
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.entries = None
+
+    def load(self):
+        if self.entries is not None:
+            return
+
+        self.entries = {}
+        if not self.path:
+            return
+
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            log.warning('Ignoring identity cache %s: %s', self.path, ex)
+
+    def save(self):
+        if not self.path:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.path)
+        except Exception as ex:
+            log.warning('Failed to write identity cache %s: %s', self.path, ex)
+
+    def get(self, spec, model):
+        self.load()
+        entry = self.entries.get(str(spec))
+        if entry is None or entry.get('model') != model:
+            return None
+        return entry
+
+    def put(self, spec, model, info, plan):
+        entry = {
+            'model': model,
+            'info': info,
+            'plan': plan,
+        }
+
+        try:
+            # only what survives a round trip through json can be cached
+            entry = json.loads(json.dumps(entry))
+        except (TypeError, ValueError):
+            return
+
+        self.load()
+        if self.entries.get(str(spec)) == entry:
+            return
+
+        self.entries[str(spec)] = entry
+        self.save()
+
+    def drop(self, spec):
+        self.load()
+        if self.entries.pop(str(spec), None) is not None:
+            self.save()
+
+identity_cache = IdentityCache()
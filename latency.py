@@ -0,0 +1,85 @@
+import math
+
+class LatencyHistogram:
+    """
+    Turnaround times of one unit in logarithmic buckets.
+
+    Bucket i counts the times up to lowest * 2**(i / steps), with four
+    buckets per doubling a percentile is off by at most 19% whatever
+    the scale.  A read the unit did not answer in time is counted as
+    a timeout, its turnaround is only known to be longer than any
+    answered one and a percentile falling among the timeouts has no
+    value.  Other failures are only counted.  Once there are twice
+    `halflife` samples all counts are halved, older samples fade out
+    and the histogram follows a unit that changes.
+    """
+    lowest = 0.001
+    steps = 4
+    nbuckets = 72
+    halflife = 500
+
+    def __init__(self):
+        self.counts = [0] * self.nbuckets
+        self.total = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def bucket(self, t):
+        if t <= self.lowest:
+            return 0
+        i = math.ceil(self.steps * math.log2(t / self.lowest))
+        return min(i, self.nbuckets - 1)
+
+    def bound(self, i):
+        return self.lowest * 2 ** (i / self.steps)
+
+    def samples(self):
+        return self.total + self.timeouts
+
+    def decay(self):
+        if self.samples() >= 2 * self.halflife:
+            self.counts = [c // 2 for c in self.counts]
+            self.total = sum(self.counts)
+            self.timeouts //= 2
+
+    def add(self, t):
+        self.counts[self.bucket(t)] += 1
+        self.total += 1
+        self.decay()
+
+    def failed(self, timeout=False):
+        """Counts a failed read, timeout if the unit did not answer"""
+        self.failures += 1
+        if timeout:
+            self.timeouts += 1
+            self.decay()
+
+    def percentile(self, p):
+        """
+        Upper bound of the bucket holding the p-th percentile, None if
+        there are no samples or it is among the timeouts.
+        """
+        if not self.total:
+            return None
+
+        n = p / 100 * self.samples()
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= n:
+                return self.bound(i)
+
+        return None
+
+    def buckets(self):
+        """The non-empty buckets as [upper bound in ms, count]"""
+        return [[round(1000 * self.bound(i), 1), c]
+                for i, c in enumerate(self.counts) if c]
+
+# kept per unit, so they survive a reinit or a new device object
+histograms = {}
+
+def get_histogram(key):
+    if key not in histograms:
+        histograms[key] = LatencyHistogram()
+    return histograms[key]
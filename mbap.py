@@ -0,0 +1,233 @@
+import itertools
+import select
+import socket
+import struct
+import threading
+import time
+
+from rtu import NativeClient, Response, ErrorResponse, check_pdu
+
+import logging
+log = logging.getLogger(__name__)
+
+MBAP = struct.Struct('>HHHB')
+
+# TCP keepalive: first probe after idle seconds, then every interval,
+# the connection is dropped after count unanswered probes
+KEEPALIVE_IDLE = 10
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+# The socket is shared by the pollers of all units behind it and keeps
+# this timeout, it only bounds sends, receives wait with poll() for the
+# deadline of their request
+SEND_TIMEOUT = 5
+
+class MbapClient(NativeClient):
+    """
+    A Modbus TCP or UDP master for one gateway or device, shared by
+    all units behind it.
+
+    Each request carries its own transaction ID and several may be
+    outstanding at once, from the pollers of different units.  Whoever
+    waits reads the next response off the connection and hands it to
+    the request with its ID, a response to a request that timed out
+    is dropped rather than taken for the answer to the next one.
+
+    TCP connections use keepalive so a gateway that went away is
+    noticed between polls.  A connection that fails is reopened on
+    the next request, after a backoff doubling from backoff_min to
+    backoff_max while it keeps failing.
+    """
+    pipelined = True
+    backoff_min = 1
+    backoff_max = 60
+
+    def __init__(self, method, host, port, timeout=1):
+        super().__init__(timeout)
+        self.method = method
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.tids = itertools.count(1)
+        self.cond = threading.Condition(self.lock)
+        self.pending = {}
+        self.reading = False
+        self.backoff = 0
+        self.retry_time = 0
+
+    def __str__(self):
+        return '%s:%s:%d' % (self.method, self.host, self.port)
+
+    def connect(self):
+        with self.lock:
+            if self.socket:
+                return True
+
+            if time.monotonic() < self.retry_time:
+                return False
+
+            try:
+                if self.method == 'udp':
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.connect((self.host, self.port))
+                else:
+                    sock = socket.create_connection((self.host, self.port),
+                                                    self._timeout)
+                    self.keepalive(sock)
+                sock.settimeout(SEND_TIMEOUT)
+            except OSError as ex:
+                self.backoff = min(max(2 * self.backoff, self.backoff_min),
+                                   self.backoff_max)
+                self.retry_time = time.monotonic() + self.backoff
+                log.error('%s: %s, retrying in %d s', self, ex, self.backoff)
+                return False
+
+            self.socket = sock
+            self.backoff = 0
+            return True
+
+    def keepalive(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                            KEEPALIVE_IDLE)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                            KEEPALIVE_INTERVAL)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT,
+                            KEEPALIVE_COUNT)
+
+    def close(self):
+        with self.lock:
+            if self.socket:
+                self.socket.close()
+                self.socket = None
+
+    def fail(self, sock, ex):
+        '''
+        Drops a connection that broke, it is reopened on demand.  A
+        request that still used one already replaced leaves it be.
+        '''
+        with self.lock:
+            if self.socket is not sock:
+                return
+            log.error('%s: %s', self, ex)
+            self.close()
+            self.backoff = self.backoff_min
+            self.retry_time = time.monotonic() + self.backoff
+
+    def wait(self, sock, deadline):
+        '''Waits for sock to become readable, False at the deadline'''
+        wait = deadline - time.monotonic()
+        if wait <= 0:
+            return False
+        p = select.poll()
+        p.register(sock, select.POLLIN)
+        return bool(p.poll(1000 * wait))
+
+    def recv_exact(self, sock, n, deadline):
+        buf = bytearray(n)
+        view = memoryview(buf)
+        pos = 0
+
+        while pos < n:
+            if not self.wait(sock, deadline):
+                raise socket.timeout('timed out in frame')
+            k = sock.recv_into(view[pos:])
+            if not k:
+                raise ConnectionError('connection closed')
+            pos += k
+
+        return buf
+
+    def recv_frame(self, sock, deadline, timeout):
+        '''
+        Receives one response, returns its transaction ID and the unit
+        and pdu, or None on timeout.
+        '''
+        if not self.wait(sock, deadline):
+            return None
+
+        if self.method == 'udp':
+            frame = sock.recv(MBAP.size + 253)
+            if len(frame) < MBAP.size + 1:
+                return None
+            tid, proto, length, unit = MBAP.unpack_from(frame)
+            return tid, unit, memoryview(frame)[MBAP.size:]
+
+        first = sock.recv(1)
+        if not first:
+            raise ConnectionError('connection closed')
+
+        # once a frame has started it must be read whole, or the
+        # connection is out of step and dropped
+        head = first + self.recv_exact(sock, MBAP.size - 1,
+                                       deadline + timeout)
+        tid, proto, length, unit = MBAP.unpack(head)
+        if length < 2 or length > 254:
+            raise ConnectionError('bad MBAP length %d' % length)
+        pdu = self.recv_exact(sock, length - 1, deadline + timeout)
+        return tid, unit, pdu
+
+    def execute(self, unit, pdu, size, timeout=None):
+        '''
+        Sends the request pdu to unit and waits for the response with
+        its transaction ID, the pdu of a normal one being size bytes.
+        '''
+        function = pdu[0]
+        timeout = timeout or self._timeout
+        deadline = time.monotonic() + timeout
+
+        with self.lock:
+            if not self.connect():
+                return ErrorResponse(function, 'Connection error')
+
+            sock = self.socket
+            tid = next(self.tids) & 0xffff
+            try:
+                sock.sendall(MBAP.pack(tid, 0, len(pdu) + 1, unit) + pdu)
+            except OSError as ex:
+                self.fail(sock, ex)
+                return ErrorResponse(function, 'Connection error')
+
+            self.pending[tid] = None
+
+        try:
+            while True:
+                with self.cond:
+                    while self.reading and self.pending[tid] is None:
+                        wait = deadline - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self.cond.wait(wait)
+
+                    resp = self.pending[tid]
+                    if resp is not None:
+                        break
+                    if time.monotonic() >= deadline:
+                        return ErrorResponse(function, 'No Response')
+                    if self.reading:
+                        continue
+                    self.reading = True
+
+                frame = None
+                try:
+                    frame = self.recv_frame(sock, deadline, timeout)
+                except OSError as ex:
+                    self.fail(sock, ex)
+                    return ErrorResponse(function, 'Connection error')
+                finally:
+                    with self.cond:
+                        self.reading = False
+                        if frame is not None and frame[0] in self.pending:
+                            self.pending[frame[0]] = frame
+                        self.cond.notify_all()
+        finally:
+            with self.lock:
+                self.pending.pop(tid, None)
+
+        if resp[1] != unit:
+            return ErrorResponse(function, 'Unexpected response')
+
+        return check_pdu(function, resp[2], size)
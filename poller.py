@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+import traceback
+
+from gi.repository import GLib
+
+from airtime import Airtime
+
+log = logging.getLogger(__name__)
+
+class Poller:
+    """
+    Runs all Modbus transactions of one port on a worker thread.
+
+    Jobs are kept in a heap ordered by the time they are due and the
+    worker sleeps until the earliest deadline, it is the only thread
+    that talks to the client.  The heap is the one queue of the bus
+    for all its units, jobs due at the same time run in the order they
+    were submitted, each as soon as the one before has its response
+    and the client has kept the gap between frames.  Every read sets
+    its own timeout from the wire time and the unit's turnaround.
+    Results are queued and the callbacks run on the GLib main loop, so
+    D-Bus publishing stays on the main loop and it never waits for a
+    unit that does not answer.
+    """
+
+    def __init__(self, modbus):
+        self.modbus = modbus
+        self.airtime = Airtime(getattr(modbus, 'baudrate', None))
+        self.jobs = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.dispatch_pending = False
+        self.running = True
+        self.thread = threading.Thread(target=self.run,
+                                       name='poller %s' % modbus.port)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, func, *args, callback=None, when=0):
+        """
+        Queue func(*args) for the worker thread, to be run at time
+        `when` or as soon as possible.  When it completes
+        callback(result, err) is called on the main loop, err being
+        the exception raised by func, if any.
+        """
+        with self.cond:
+            heapq.heappush(self.jobs,
+                           (when, next(self.seq), func, args, callback))
+            self.cond.notify()
+
+    def stop(self):
+        """Ends the worker thread, the jobs still queued are dropped"""
+        with self.cond:
+            self.running = False
+            self.jobs.clear()
+            self.cond.notify()
+
+    def next_job(self):
+        with self.cond:
+            while self.running:
+                now = time.time()
+                if self.jobs and self.jobs[0][0] <= now:
+                    return heapq.heappop(self.jobs)
+
+                self.cond.wait(self.jobs[0][0] - now if self.jobs else None)
+
+        return None
+
+    def run(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+
+            when, seq, func, args, callback = job
+            result = None
+            err = None
+
+            try:
+                result = func(*args)
+            except Exception as ex:
+                err = ex
+
+            if callback:
+                self.results.put((callback, result, err))
+                self.wakeup()
+
+    def wakeup(self):
+        with self.lock:
+            if self.dispatch_pending:
+                return
+            self.dispatch_pending = True
+
+        GLib.idle_add(self.dispatch)
+
+    def dispatch(self):
+        with self.lock:
+            self.dispatch_pending = False
+
+        while True:
+            try:
+                callback, result, err = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                callback(result, err)
+            except:
+                log.error('Uncaught exception in poller callback')
+                traceback.print_exc()
+
+        return False
+
+pollers = {}
+
+def get_poller(modbus, unit=None):
+    """
+    Return the poller owning the given client, creating it on first use.
+    Clients that can have several requests outstanding get a poller
+    per unit, so the units behind one gateway are polled concurrently.
+    """
+    key = modbus
+    if getattr(modbus, 'pipelined', False):
+        key = (modbus, unit)
+
+    if key not in pollers:
+        pollers[key] = Poller(modbus)
+
+    return pollers[key]
+
+def release_pollers(modbus):
+    """
+    Stops the pollers of a client no device uses any more, get_poller()
+    starts a new one when it is used again.
+    """
+    for key in [k for k, p in pollers.items() if p.modbus is modbus]:
+        pollers.pop(key).stop()
@@ -0,0 +1,47 @@
+import time
+
+from gi.repository import GLib
+
+class Publisher:
+    """
+    Emits the changes of all services together, at most `rate` times
+    a second.
+
+    Devices schedule their service context after each poll instead of
+    flushing it, all contexts scheduled within one period are flushed
+    together, one ItemsChanged per service.  A path changed several
+    times within the period is only sent with its latest value since
+    the context keeps one entry per path.
+    """
+
+    def __init__(self, rate=4):
+        self.rate = rate
+        self.pending = {}
+        self.timer = None
+        self.last = 0
+        self.flushes = 0
+
+    def schedule(self, ctx):
+        self.pending[ctx] = True
+
+        if self.timer is None:
+            delay = max(self.last + 1.0 / self.rate - time.time(), 0)
+            self.timer = GLib.timeout_add(int(delay * 1000), self.flush)
+
+    def discard(self, ctx):
+        self.pending.pop(ctx, None)
+
+    def flush(self):
+        self.timer = None
+        self.last = time.time()
+        self.flushes += 1
+
+        pending = self.pending
+        self.pending = {}
+
+        for ctx in pending:
+            ctx.flush()
+
+        return False
+
+publisher = Publisher()
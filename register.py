@@ -6,13 +6,23 @@ import logging
 log = logging.getLogger(__name__)
 
 class Reg:
+    # Attributes of every register.  Reg itself has no slots, so it
+    # can be combined with int and str, which do not support them,
+    # subclasses of float use these as their __slots__.
+    fields = ('base', 'name', 'value', 'write', 'onchange', 'time',
+              'max_age', 'text', 'access', 'priority', 'deadband')
+    __slots__ = ()
+
     def __new__(cls, *args, **kwargs):
         return super().__new__(cls)
 
     def __init__(self, base, count, name=None, text=None, write=False,
-                 max_age=None, onchange=None, access=None):
+                 max_age=None, onchange=None, access=None, priority=None,
+                 deadband=None):
         self.base = base
-        self.count = count
+        # fixed size registers have count as a class attribute
+        if getattr(type(self), 'count', None) != count:
+            self.count = count
         self.name = name
         self.value = None
         self.write = write
@@ -21,6 +31,8 @@ class Reg:
         self.max_age = max_age
         self.text = text
         self.access = access
+        self.priority = priority
+        self.deadband = deadband
 
     def __eq__(self, other):
         if isinstance(other, type(self)):
@@ -34,19 +46,26 @@ class Reg:
         return int(self.value)
 
     def __str__(self):
+        return self.format(self.value)
+
+    def format(self, value):
+        """Renders a value of this register as text"""
         if isinstance(self.text, str):
             try:
-                return self.text % self.value
+                return self.text % value
             except Exception as err :
-                log.info(f'failed {err} {self.name} {self.text} {self.value} {type(self.text)} {type(self.value)}')
+                log.info(f'failed {err} {self.name} {self.text} {value} {type(self.text)} {type(value)}')
         if hasattr(self.text, '__getitem__'):
             try:
-                return self.text[self.value]
+                return self.text[value]
             except:
                 pass
         if callable(self.text):
-            return self.text(self.value)
-        return str(self.value)
+            return self.text(value)
+        return str(value)
+
+    def dbus_text(self, path, value):
+        return self.format(value)
 
     def isvalid(self):
         return self.value is not None
@@ -62,6 +81,20 @@ class Reg:
     def decode(self, values):
         return self.update(values)
 
+    def field_code(self):
+        """
+        Returns the struct code decoding this register from big endian
+        words, None if it needs its own decode().
+        """
+        return None
+
+    def same_decode(self, other):
+        """
+        Returns True if other reads the same words and decodes them to
+        the same value and text, so one of them can serve both paths.
+        """
+        return False
+
     def encode(self):
         return self.value
 
@@ -69,6 +102,7 @@ class Reg:
         return copy(self) if self.isvalid() else None
 
 class Reg_num(Reg, float):
+    __slots__ = Reg.fields + ('scale', 'invalid')
     rtype = int
 
     def __init__(self, base, name=None, scale=1, text=None, write=False, invalid=[], **kwargs):
@@ -81,60 +115,92 @@ class Reg_num(Reg, float):
 
     def decode(self, values):
         v = struct.unpack(self.coding[0], struct.pack(self.coding[1], *values))
-        if v[0] in self.invalid:
+        return self.decode_value(v[0])
+
+    def decode_value(self, v):
+        if v in self.invalid:
             return self.update(None)
-        return self.set_raw_value(v[0])
+        return self.set_raw_value(v)
+
+    def field_code(self):
+        if type(self).decode is not Reg_num.decode or self.coding[1][0] == '<':
+            return None
+        return self.coding[0].lstrip('>')
+
+    def same_decode(self, other):
+        return (type(other) is type(self) and
+                self.field_code() is not None and
+                other.base == self.base and
+                other.scale == self.scale and
+                other.invalid == self.invalid and
+                other.text == self.text and
+                other.access == self.access and
+                other.write == self.write and
+                other.deadband == self.deadband and
+                not self.onchange and not other.onchange)
 
     def encode(self):
         v = self.rtype(self.value * self.scale)
         return struct.unpack(self.coding[1], struct.pack(self.coding[0], v))
 
 class Reg_s16(Reg_num):
+    __slots__ = ()
     coding = ('h', 'H')
     count = 1
 
 class Reg_u16(Reg_num):
+    __slots__ = ()
     coding = ('H', 'H')
     count = 1
 
 class Reg_s32b(Reg_num):
+    __slots__ = ()
     coding = ('>i', '>2H')
     count = 2
 
 class Reg_u32b(Reg_num):
+    __slots__ = ()
     coding = ('>I', '>2H')
     count = 2
 
 class Reg_s64b(Reg_num):
+    __slots__ = ()
     coding = ('>q', '>4H')
     count = 4
 
 class Reg_u64b(Reg_num):
+    __slots__ = ()
     coding = ('>Q', '>4H')
     count = 4
 
 class Reg_f32b(Reg_num):
+    __slots__ = ()
     coding = ('>f', '>2H')
     count = 2
     rtype = float
 
 class Reg_s32l(Reg_num):
+    __slots__ = ()
     coding = ('<i', '<2H')
     count = 2
 
 class Reg_u32l(Reg_num):
+    __slots__ = ()
     coding = ('<I', '<2H')
     count = 2
 
 class Reg_s64l(Reg_num):
+    __slots__ = ()
     coding = ('<q', '<4H')
     count = 4
 
 class Reg_u64l(Reg_num):
+    __slots__ = ()
     coding = ('<Q', '<4H')
     count = 4
 
 class Reg_f32l(Reg_num):
+    __slots__ = ()
     coding = ('<f', '<2H')
     count = 2
     rtype = float
@@ -217,3 +283,97 @@ class Reg_bit(Reg, int):
     def decode(self, values):
         v = values[self.bit // 16] & (1 << self.bit % 16)
         return self.update(self.set if v else self.unset)
+
+class RegDecoder:
+    """
+    Decodes the response of one read into all registers it covers.
+
+    The layout is compiled once into a single struct, holes become pad
+    bytes, so decoding a response is one unpack_from() followed by the
+    scale and invalid value handling of each field.  Registers that
+    need their own decode() get their words instead, as do registers
+    overlapping another one, unless they are identical to it and share
+    its value.
+    """
+
+    def __init__(self, regs, start, count):
+        self.words = struct.Struct('>%dH' % count)
+        self.fields = []
+        self.overlaps = []
+
+        fmt = ['>']
+        pos = start
+        prev = None
+
+        for r in regs:
+            if r.base < start or r.base + r.count > start + count:
+                continue
+
+            code = r.field_code()
+
+            if r.base < pos:
+                if prev and code and (r.base, r.count, code) == prev[0]:
+                    prev[1].append(r)
+                else:
+                    self.overlaps.append((r, struct.Struct('>%dH' % r.count),
+                                          2 * (r.base - start)))
+                continue
+
+            if r.base > pos:
+                fmt.append('%dx' % (2 * (r.base - pos)))
+
+            if code:
+                fmt.append(code)
+                prev = ((r.base, r.count, code), [r], None)
+            else:
+                fmt.append('%dH' % r.count)
+                prev = ((r.base, r.count, None), [r], r.count)
+
+            self.fields.append(prev[1:])
+            pos = r.base + r.count
+
+        self.struct = struct.Struct(''.join(fmt))
+
+    def pack(self, registers):
+        return self.words.pack(*registers)
+
+    def data(self, rr):
+        """
+        Returns the register data of a read response as bytes, the
+        native RTU client has them already.
+        """
+        payload = getattr(rr, 'payload', None)
+        if payload is not None:
+            return payload
+        return self.pack(rr.registers)
+
+    def decode(self, buf, now):
+        """
+        Decodes a response, given as bytes, and returns the registers
+        that changed or were read for the first time.
+        """
+        values = self.struct.unpack_from(buf)
+        changed = []
+        i = 0
+
+        for regs, nwords in self.fields:
+            if nwords is None:
+                v = values[i]
+                i += 1
+                for r in regs:
+                    if r.decode_value(v) or not r.time:
+                        changed.append(r)
+                    r.time = now
+            else:
+                r = regs[0]
+                if r.decode(values[i:i + nwords]) or not r.time:
+                    changed.append(r)
+                r.time = now
+                i += nwords
+
+        for r, words, offset in self.overlaps:
+            if r.decode(words.unpack_from(buf, offset)) or not r.time:
+                changed.append(r)
+            r.time = now
+
+        return changed
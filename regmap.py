@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+
+import register
+
+log = logging.getLogger(__name__)
+
+MAP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# register options taken over from a map entry as they are
+OPTIONS = ('scale', 'text', 'max_age', 'access', 'priority', 'deadband',
+           'invalid', 'write')
+
+maps = {}
+
+def address(v):
+    return int(v, 0) if isinstance(v, str) else int(v)
+
+class RegMap:
+    """
+    A register map of a driver, described in JSON:
+
+        {
+          "info": [
+            { "base": "0xfc00", "type": "u32b", "path": "/Serial",
+              "access": "holding" }
+          ],
+          "data": [
+            { "base": "0x0000", "type": "f32b",
+              "paths": ["/Ac/Voltage", "/Ac/L1/Voltage"],
+              "text": "%.1f V", "max_age": 0.28 }
+          ]
+        }
+
+    The type names a Reg_ class of the register module, text registers
+    also need a count and map registers a "map" of values to text.  An
+    entry with several paths is read and decoded once, its value is
+    published to the other paths as aliases of the first.
+
+    The file is parsed once, every device gets its own registers which
+    init_data_regs() packs and compiles decoders for as usual.
+    """
+
+    def __init__(self, spec):
+        self.info = spec.get('info', [])
+        self.data = spec.get('data', [])
+
+    @staticmethod
+    def make_reg(e, name):
+        cls = getattr(register, 'Reg_' + e['type'])
+        base = address(e['base'])
+        kwargs = {k: e[k] for k in OPTIONS if k in e}
+
+        if 'map' in e:
+            tab = {address(k): v for k, v in e['map'].items()}
+            return cls(base, name, tab, **kwargs)
+
+        if 'count' in e:
+            return cls(base, e['count'], name, **kwargs)
+
+        return cls(base, name, **kwargs)
+
+    def make_regs(self, entries, aliases):
+        regs = []
+
+        for e in entries:
+            paths = e.get('paths') or [e.get('path')]
+            regs.append(self.make_reg(e, paths[0]))
+            if len(paths) > 1:
+                aliases[paths[0]] = list(paths[1:])
+
+        return regs
+
+    def info_regs(self):
+        return self.make_regs(self.info, {})
+
+    def data_regs(self, aliases):
+        """
+        Returns new data registers, the alias paths are added to
+        aliases keyed by the path of the register.
+        """
+        return self.make_regs(self.data, aliases)
+
+def load(name):
+    """Returns the register map in a file next to this module"""
+    if name in maps:
+        return maps[name]
+
+    path = os.path.join(MAP_DIR, name)
+    with open(path) as f:
+        m = maps[name] = RegMap(json.load(f))
+
+    log.debug('Loaded register map %s', path)
+    return m
@@ -0,0 +1,314 @@
+import os
+import select
+import struct
+import threading
+import time
+
+import serial
+
+from airtime import frame_gap
+
+import logging
+log = logging.getLogger(__name__)
+
+# largest RTU frame: address, 253 bytes PDU, crc
+MAX_ADU = 256
+
+# USB serial adapters hand over received bytes in chunks, a gap this
+# much longer than 3.5 characters still belongs to the frame
+USB_LATENCY = 0.016
+
+def make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xa001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+CRC_TABLE = make_crc_table()
+
+def crc16(data):
+    '''Modbus CRC16 of data, 0 over a frame including its crc'''
+    crc = 0xffff
+    for b in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ b) & 0xff]
+    return crc
+
+def response_size(function, count=0):
+    '''Length of the PDU of the normal response to a request'''
+    if function in (3, 4, 23):
+        return 2 + 2 * count
+    return 5
+
+class Response:
+    """
+    A normal response.  The payload is a view of the client's receive
+    buffer and only valid until its next transaction, it holds the
+    register data of a read as big endian words.
+    """
+    __slots__ = ('function', 'payload')
+
+    def __init__(self, function, payload):
+        self.function = function
+        self.payload = payload
+
+    def isError(self):
+        return False
+
+    @property
+    def registers(self):
+        return list(struct.unpack('>%dH' % (len(self.payload) // 2),
+                                  self.payload))
+
+    def __str__(self):
+        return 'Response function:%d length:%d' % (self.function,
+                                                   len(self.payload))
+
+class ErrorResponse:
+    """An exception response, or no or a corrupt response"""
+    __slots__ = ('function', 'exception_code', 'message')
+
+    def __init__(self, function, message, exception_code=None):
+        self.function = function
+        self.message = message
+        self.exception_code = exception_code
+
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return 'Function %d: %s' % (self.function, self.message)
+
+class NativeClient:
+    """
+    The Modbus functions used by the devices, the reference counting
+    and the context manager of the clients of this package, which
+    implement execute() for their transport.  Each function takes the
+    timeout of its transaction, the client's one is used without.
+    """
+    native = True
+
+    def __init__(self, timeout):
+        self._timeout = timeout
+        self.refcount = 1
+        self.lock = threading.RLock()
+
+    def get(self):
+        self.refcount += 1
+        return self
+
+    def put(self):
+        if self.refcount > 0:
+            self.refcount -= 1
+        if self.refcount == 0:
+            self.close()
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, t):
+        self._timeout = t
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+    def read_holding_registers(self, address, count=1, unit=0, timeout=None):
+        return self.execute(unit, struct.pack('>BHH', 3, address, count),
+                            response_size(3, count), timeout)
+
+    def read_input_registers(self, address, count=1, unit=0, timeout=None):
+        return self.execute(unit, struct.pack('>BHH', 4, address, count),
+                            response_size(4, count), timeout)
+
+    def read_registers(self, address, count, access, **kwargs):
+        if access == 'holding':
+            return self.read_holding_registers(address, count, **kwargs)
+
+        if access == 'input':
+            return self.read_input_registers(address, count, **kwargs)
+
+        raise Exception('Invalid register access type: %s' % access)
+
+    def write_register(self, address, value, unit=0, timeout=None):
+        return self.execute(unit, struct.pack('>BHH', 6, address, value),
+                            response_size(6), timeout)
+
+    def write_registers(self, address, values, unit=0, timeout=None):
+        n = len(values)
+        pdu = struct.pack('>BHHB%dH' % n, 16, address, n, 2 * n, *values)
+        return self.execute(unit, pdu, response_size(16), timeout)
+
+    def readwrite_registers(self, read_address=0, read_count=0,
+                            write_address=0, write_registers=[], unit=0,
+                            timeout=None):
+        n = len(write_registers)
+        pdu = struct.pack('>BHHHHB%dH' % n, 23, read_address, read_count,
+                          write_address, n, 2 * n, *write_registers)
+        return self.execute(unit, pdu, response_size(23, read_count),
+                            timeout)
+
+def check_pdu(function, pdu, size):
+    '''
+    Returns the response in a received pdu, size is the length of a
+    normal response.
+    '''
+    if len(pdu) < 2 or pdu[0] & 0x7f != function:
+        return ErrorResponse(function, 'Unexpected response')
+    if pdu[0] & 0x80:
+        return ErrorResponse(function, 'Exception %d' % pdu[1], pdu[1])
+    if len(pdu) < size:
+        return ErrorResponse(function, 'Incomplete response')
+
+    if function in (3, 4, 23):
+        if pdu[1] != size - 2:
+            return ErrorResponse(function, 'Wrong byte count')
+        return Response(function, pdu[2:size])
+    return Response(function, pdu[1:size])
+
+class RtuClient(NativeClient):
+    """
+    A Modbus RTU master talking to the serial port directly.
+
+    Requests are built and responses checked in place, the response is
+    received into a preallocated buffer without building frames, hex
+    dumps or response objects per register.  Since the length of a
+    response follows from the request, the read ends as soon as the
+    frame is complete, or after the header of an exception response.
+    The port is waited on with poll(), received bytes are read as soon
+    as they arrive and a frame cut short ends after a silence of 3.5
+    characters, so a transaction takes little more than its wire time.
+    Reads return the register data as a Response whose payload can be
+    decoded by a RegDecoder as it is.
+
+    It is a drop in for SerialClient as far as the devices go.
+    """
+    method = 'rtu'
+
+    def __init__(self, port, baudrate, timeout=1):
+        super().__init__(timeout)
+        self.port = port
+        self.baudrate = baudrate
+        self.socket = None
+        self.buf = bytearray(MAX_ADU)
+        self.view = memoryview(self.buf)
+        self.t35 = frame_gap(baudrate)
+        self.silence = self.t35 + USB_LATENCY
+        self.last_frame_end = 0
+        self.poll = None
+
+    def connect(self):
+        if self.socket:
+            return True
+        try:
+            self.socket = serial.Serial(port=self.port,
+                                        baudrate=self.baudrate,
+                                        timeout=self._timeout)
+            self.poll = select.poll()
+            self.poll.register(self.socket.fd, select.POLLIN)
+        except serial.SerialException as msg:
+            log.error(msg)
+            self.socket = None
+        return self.socket is not None
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+            self.poll = None
+
+    def recv(self, size, timeout):
+        '''
+        Receives a response of size bytes into the buffer, or the five
+        bytes of an exception response.  Returns the bytes received,
+        fewer when the unit does not answer within the timeout or stops
+        sending.
+        '''
+        view = self.view
+        fd = self.socket.fd
+        deadline = time.monotonic() + timeout
+        n = 0
+
+        while n < size:
+            wait = deadline - time.monotonic()
+            if n:
+                wait = min(wait, self.silence)
+            if wait <= 0:
+                break
+
+            events = self.poll.poll(1000 * wait)
+            if not events:
+                break
+            if events[0][1] & (select.POLLERR | select.POLLHUP |
+                               select.POLLNVAL):
+                raise serial.SerialException('%s disconnected' % self.port)
+
+            try:
+                n += os.readv(fd, [view[n:size]])
+            except BlockingIOError:
+                continue
+
+            if n >= 2 and view[1] & 0x80:
+                size = 5
+
+        return n
+
+    def execute(self, unit, pdu, size, timeout=None):
+        '''
+        Sends the request pdu to unit and returns the response, the
+        pdu of a normal one being size bytes long.
+        '''
+        function = pdu[0]
+        size += 3
+
+        with self.lock:
+            if not self.connect():
+                return ErrorResponse(function, 'Connection error')
+
+            frame = bytes([unit]) + pdu
+            frame += struct.pack('<H', crc16(frame))
+
+            wait = self.last_frame_end + self.t35 - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            self.socket.reset_input_buffer()
+            self.socket.write(frame)
+
+            if unit == 0:
+                # broadcast, no answer
+                self.socket.flush()
+                self.last_frame_end = time.monotonic()
+                return Response(function, b'')
+
+            try:
+                n = self.recv(size, timeout or self._timeout)
+            except (OSError, serial.SerialException) as ex:
+                log.error('%s', ex)
+                self.close()
+                return ErrorResponse(function, 'Port error')
+            self.last_frame_end = time.monotonic()
+
+            return self.check(unit, function, n, size)
+
+    def check(self, unit, function, n, size):
+        view = self.view
+
+        if n < 5:
+            return ErrorResponse(function, 'No Response')
+        if view[0] != unit:
+            return ErrorResponse(function, 'Unexpected response')
+        if crc16(view[:n]):
+            return ErrorResponse(function, 'CRC error')
+
+        return check_pdu(function, view[1:n - 2], size - 3)
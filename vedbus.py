@@ -60,10 +60,14 @@ log = logging.getLogger(__name__)
 
 # Export ourselves as a D-Bus service.
 class VeDbusService(object):
-	def __init__(self, servicename, bus=None):
+	# @param itemtype	class of the items added by add_path, unless given there
+	def __init__(self, servicename, bus=None, itemtype=None):
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
+		self._itemtype = itemtype or VeDbusItemExport
 		self._dbusnodes = {}
+		# number of objects below each tree node path
+		self._nodecount = {}
 		self._ratelimiters = []
 		self._dbusname = None
 
@@ -86,13 +90,18 @@ class VeDbusService(object):
 
 	# To force immediate deregistering of this dbus service and all its object paths, explicitly
 	# call __del__().
+	# Everything goes at once, so the items are removed without going through
+	# the per path bookkeeping of _item_deleted.
 	def __del__(self):
 		for node in list(self._dbusnodes.values()):
 			node.__del__()
 		self._dbusnodes.clear()
-		for item in list(self._dbusobjects.values()):
+		self._nodecount.clear()
+		objects = self._dbusobjects
+		self._dbusobjects = {}
+		for item in objects.values():
+			item._deletecallback = None
 			item.__del__()
-		self._dbusobjects.clear()
 		if self._dbusname:
 			self._dbusname.__del__()  # Forces call to self._bus.release_name(self._name), see source code
 		self._dbusname = None
@@ -100,22 +109,33 @@ class VeDbusService(object):
 	def get_name(self):
 		return self._dbusname.get_name()
 
+	# Moves the service to another bus name, the object paths stay as they are
+	# registered on the connection, not the name.
+	def rename(self, servicename):
+		self._dbusname.__del__()
+		self._dbusname = dbus.service.BusName(servicename, self._dbusconn, do_not_queue=True)
+		log.info("renamed ourselves on D-Bus to %s" % servicename)
+
 	# @param callbackonchange	function that will be called when this value is changed. First parameter will
 	#							be the path of the object, second the new value. This callback should return
 	#							True to accept the change, False to reject it.
 	def add_path(self, path, value, description="", writeable=False,
 					onchangecallback=None, gettextcallback=None, valuetype=None, itemtype=None):
 
+		# An object path can only be registered once, replace the old item
+		if path in self._dbusobjects:
+			self._dbusobjects[path].__del__()
+			self._onchangecallbacks.pop(path, None)
+
 		if onchangecallback is not None:
 			self._onchangecallbacks[path] = onchangecallback
 
-		itemtype = itemtype or VeDbusItemExport
+		itemtype = itemtype or self._itemtype
 		item = itemtype(self._dbusconn, path, value, description, writeable,
 				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype)
 
-		spl = path.split('/')
-		for i in range(2, len(spl)):
-			subPath = '/'.join(spl[:i])
+		for subPath in self._subpaths(path):
+			self._nodecount[subPath] = self._nodecount.get(subPath, 0) + 1
 			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
 				self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
 		self._dbusobjects[path] = item
@@ -144,16 +164,25 @@ class VeDbusService(object):
 
 		return self._onchangecallbacks[path](path, newvalue)
 
+	# The tree nodes above a path, excluding the root
+	@staticmethod
+	def _subpaths(path):
+		spl = path.split('/')
+		return ('/'.join(spl[:i]) for i in range(2, len(spl)))
+
+	# Removes the tree nodes that no longer have objects below them, only
+	# the nodes above the deleted path can be affected.
 	def _item_deleted(self, path):
 		self._dbusobjects.pop(path)
-		for np in list(self._dbusnodes.keys()):
-			if np != '/':
-				for ip in self._dbusobjects:
-					if ip.startswith(np + '/'):
-						break
-				else:
-					self._dbusnodes[np].__del__()
-					self._dbusnodes.pop(np)
+		for np in self._subpaths(path):
+			n = self._nodecount.get(np, 0) - 1
+			if n > 0:
+				self._nodecount[np] = n
+				continue
+			self._nodecount.pop(np, None)
+			node = self._dbusnodes.pop(np, None)
+			if node is not None:
+				node.__del__()
 
 	def __getitem__(self, path):
 		return self._dbusobjects[path].local_get_value()
@@ -191,26 +220,27 @@ class ServiceContext(object):
 		return self.parent[path]
 
 	def __setitem__(self, path, newvalue):
-		c = self.parent._dbusobjects[path]._local_set_value(newvalue)
-		if c is not None:
-			self.changes[path] = c
+		item = self.parent._dbusobjects[path]
+		if item._set_value(newvalue):
+			self.changes[path] = item
 
 	def __delitem__(self, path):
 		if path in self.changes:
 			del self.changes[path]
 		del self.parent[path]
 
+	# Changed items are only rendered here, once per flush, so a value
+	# that changes several times in between is wrapped and its text
+	# formatted only once.
 	def flush(self):
 		if self.changes:
-			self.parent._dbusnodes['/'].ItemsChanged(self.changes)
+			self.parent._dbusnodes['/'].ItemsChanged(
+				{p: item._get_changes() for p, item in self.changes.items()})
 			self.changes.clear()
 
 	def add_path(self, path, value, *args, **kwargs):
 		self.parent.add_path(path, value, *args, **kwargs)
-		self.changes[path] = {
-			'Value': wrap_dbus_value(value),
-			'Text': self.parent._dbusobjects[path].GetText()
-		}
+		self.changes[path] = self.parent._dbusobjects[path]
 
 	def del_tree(self, root):
 		root = root.rstrip('/')
@@ -473,9 +503,7 @@ class VeDbusRootExport(VeDbusTreeExport):
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}')
 	def GetItems(self):
 		return {
-			path: {
-				'Value': wrap_dbus_value(item.local_get_value()),
-				'Text': item.GetText() }
+			path: item._get_changes()
 			for path, item in self._service._dbusobjects.items()
 		}
 
@@ -532,12 +560,21 @@ class VeDbusItemExport(dbus.service.Object):
 			self.PropertiesChanged(changes)
 
 	def _local_set_value(self, newvalue):
-		if self._value == newvalue:
+		if not self._set_value(newvalue):
 			return None
 
+		return self._get_changes()
+
+	def _set_value(self, newvalue):
+		if self._value == newvalue:
+			return False
+
 		self._value = newvalue
+		return True
+
+	def _get_changes(self):
 		return {
-			'Value': wrap_dbus_value(newvalue),
+			'Value': wrap_dbus_value(self._value),
 			'Text': self.GetText()
 		}
 
@@ -626,6 +663,75 @@ class VeDbusItemExport(dbus.service.Object):
 	def PropertiesChanged(self, changes):
 		pass
 
+## VeDbusItemExport that caches the D-Bus form of its value
+# The wrapper type is resolved once per path, when a value of a new type is
+# first seen, instead of walking the isinstance chain of wrap_dbus_value on
+# every change, and the wrapped value and text are only produced on the first
+# GetValue, GetText, GetItems or flush after a change, then kept until the
+# next one.
+class VeDbusTypedItemExport(VeDbusItemExport):
+	_wraps = {
+		float: dbus.Double,
+		int: dbus.Int32,
+		str: dbus.String,
+	}
+
+	def __init__(self, *args, **kwargs):
+		VeDbusItemExport.__init__(self, *args, **kwargs)
+		self._wrapped = None
+		self._text = None
+		self._type = None
+		self._wrapper = None
+
+	def _set_value(self, newvalue):
+		if self._value == newvalue:
+			return False
+
+		self._value = newvalue
+		self._wrapped = None
+		self._text = None
+		return True
+
+	def _wrap(self):
+		v = self._value
+		if type(v) is not self._type:
+			self._type = type(v)
+			self._wrapper = self._wraps.get(self._type)
+
+		t = self._wrapper
+		if t is None:
+			w = wrap_dbus_value(v)
+		else:
+			try:
+				w = t(v, variant_level=1)
+			except OverflowError:
+				w = wrap_dbus_value(v)
+
+		self._wrapped = w
+		return w
+
+	def _get_changes(self):
+		w = self._wrapped
+		if w is None:
+			w = self._wrap()
+
+		t = self._text
+		if t is None:
+			t = self._text = VeDbusItemExport.GetText(self)
+
+		return { 'Value': w, 'Text': t }
+
+	def GetValue(self):
+		w = self._wrapped
+		if w is None:
+			w = self._wrap()
+		return w
+
+	def GetText(self):
+		if self._text is None:
+			self._text = VeDbusItemExport.GetText(self)
+		return self._text
+
 ## This class behaves like a regular reference to a class method (eg. self.foo), but keeps a weak reference
 ## to the object which method is to be called.
 ## Use this object to break circular references.
@@ -60,7 +60,7 @@ class VregLink:
                                             read_count=nread,
                                             write_address=self.vreglink_base,
                                             write_registers=data,
-                                            unit=self.unit)
+                                            **self.modbus_args())
 
         if r.isError():
             self.log.error('Modbus error accessing vreg %#04x: %s', regid, r)